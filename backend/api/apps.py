@@ -1,6 +1,44 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from foodgram.db import (check_reused_connections,
+                                 count_opened_connection)
+        from foodgram.metrics import (install_query_recorder,
+                                      instrument_serializers)
+        from foodgram.slow_queries import slow_query_logger
+        from recipes.models import Ingredient, Tag
+        from .cache import ingredients_cache, tags_cache
+
+        request_started.connect(
+            check_reused_connections, dispatch_uid='check_reused_connections'
+        )
+        connection_created.connect(
+            count_opened_connection, dispatch_uid='count_opened_connection'
+        )
+        connection_created.connect(
+            install_query_recorder, dispatch_uid='install_query_recorder'
+        )
+        instrument_serializers()
+        if settings.SLOW_QUERY_DIR:
+            connection_created.connect(
+                slow_query_logger.install, dispatch_uid='slow_query_logger'
+            )
+
+        for model, reference_cache in (
+            (Tag, tags_cache),
+            (Ingredient, ingredients_cache),
+        ):
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    reference_cache.bump, sender=model,
+                    dispatch_uid=f'{reference_cache.name}_{signal}'
+                )
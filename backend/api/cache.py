@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from .constants import REFERENCE_CACHE_PREFIX, REFERENCE_CACHE_TIMEOUT
+
+GZIP_ETAG_SUFFIX = '-gz'
+
+
+class ReferenceCache:
+    """Готовые ответы справочников, привязанные к номеру поколения.
+
+    Поколение хранится в общем кэше и увеличивается при любом
+    изменении данных, поэтому старые тела и ETag просто перестают
+    запрашиваться.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.generation_key = f'{REFERENCE_CACHE_PREFIX}:{name}:generation'
+
+    def generation(self):
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            cache.add(self.generation_key, time.time_ns(), timeout=None)
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def bump(self, *args, **kwargs):
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            cache.set(self.generation_key, time.time_ns(), timeout=None)
+
+    def key(self, generation, part):
+        return f'{REFERENCE_CACHE_PREFIX}:{self.name}:{generation}:{part}'
+
+    def get_body(self, generation, render):
+        key = self.key(generation, 'body')
+        body = cache.get(key)
+        if body is None:
+            content = render()
+            body = {
+                'content': content,
+                'gzip': gzip.compress(content),
+                'etag': hashlib.sha1(content).hexdigest(),
+            }
+            cache.set_many(
+                {key: body, self.key(generation, 'etag'): body['etag']},
+                timeout=REFERENCE_CACHE_TIMEOUT,
+            )
+        return body
+
+    def response(self, request, render):
+        """Ответ справочника с ETag отдельно для gzip и без сжатия.
+
+        ETag хранится под своим небольшим ключом, поэтому ответ 304
+        не читает из кэша само тело.
+        """
+        generation = self.generation()
+        use_gzip = accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        suffix = GZIP_ETAG_SUFFIX if use_gzip else ''
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        etag = cache.get(self.key(generation, 'etag'))
+        if etag is not None and if_none_match and (
+            if_none_match.strip() == '*'
+            or f'"{etag}{suffix}"' in parse_etags(if_none_match)
+        ):
+            response = HttpResponseNotModified()
+        else:
+            body = self.get_body(generation, render)
+            etag = body['etag']
+            response = HttpResponse(
+                body['gzip' if use_gzip else 'content'],
+                content_type='application/json'
+            )
+            if use_gzip:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = f'"{etag}{suffix}"'
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+def accepts_gzip(accept_encoding):
+    """Принимает ли клиент gzip с учётом весов q из Accept-Encoding."""
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, *params = (part.strip() for part in item.split(';'))
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding.lower()] = weight
+    return weights.get('gzip', weights.get('*', 0)) > 0
+
+
+tags_cache = ReferenceCache('tags')
+ingredients_cache = ReferenceCache('ingredients')
@@ -1 +1,19 @@
 MIN_INGREDIENT_AMOUNT = 0
+SHOPPING_LIST_TITLE = 'Список покупок:'
+SHOPPING_LIST_CHUNK_SIZE = 500
+PDF_LINES_PER_PAGE = 50
+PDF_FONT_NAME = 'DejaVuSans'
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 16
+PDF_PAGE_WIDTH = 595
+PDF_PAGE_HEIGHT = 842
+PDF_MARGIN = 50
+INGREDIENT_SEARCH_PARAMS = ('name', 'search')
+REFERENCE_CACHE_PREFIX = 'reference'
+REFERENCE_CACHE_TIMEOUT = 60 * 60 * 24
+PAGINATION_MODE_QUERY_PARAM = 'pagination'
+KEYSET_MODE = 'cursor'
+KEYSET_DEFAULT_ORDERING = ('-pub_date', '-id')
+KEYSET_INCOMPATIBLE_PARAMS = ('search', 'ordering')
+RECIPES_LIMIT_QUERY_PARAM = 'recipes_limit'
+SEARCH_HIGHLIGHT_QUERY_PARAM = 'highlight'
@@ -1,6 +1,7 @@
 from django_filters.rest_framework import FilterSet, filters
 
 from recipes.models import Ingredient, Recipe
+from .constants import SEARCH_HIGHLIGHT_QUERY_PARAM
 
 
 class RecipeFilter(FilterSet):
@@ -11,10 +12,15 @@ class RecipeFilter(FilterSet):
         method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.OrderingFilter(
+        fields=('pub_date', 'favorites_count', 'in_carts_count')
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering')
 
     def get_is_favorited(self, queryset, name, value):
         user = self.request.user
@@ -28,6 +34,12 @@ class RecipeFilter(FilterSet):
             return queryset.filter(shopping_cart__user=user)
         return queryset
 
+    def get_search(self, queryset, name, value):
+        highlight = self.request.query_params.get(SEARCH_HIGHLIGHT_QUERY_PARAM)
+        return queryset.search(
+            value, highlight=highlight in ('1', 'true', 'True')
+        )
+
 
 class IngredientFilter(FilterSet):
     name = filters.CharFilter(field_name='name', lookup_expr='icontains')
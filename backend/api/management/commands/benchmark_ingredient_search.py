@@ -0,0 +1,52 @@
+from time import perf_counter
+
+from django.core.management import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.search import ingredient_index
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+
+DEFAULT_QUERIES = ('а', 'мо', 'мол', 'сах', 'ябл', 'соль', 'ёж', 'масло')
+
+
+def orm_search(query):
+    queryset = Ingredient.objects.filter(name__icontains=query)
+    return JSONRenderer().render(
+        IngredientSerializer(queryset, many=True).data
+    )
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск ингредиентов через ORM и через индекс'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=DEFAULT_QUERIES)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def measure(self, function, query, repeat):
+        start = perf_counter()
+        for _ in range(repeat):
+            function(query)
+        return (perf_counter() - start) / repeat * 1000
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        start = perf_counter()
+        ingredient_index.invalidate()
+        ingredient_index.search('')
+        self.stdout.write(
+            f'Индекс построен за {(perf_counter() - start) * 1000:.2f} мс'
+        )
+        self.stdout.write(
+            f'{"запрос":<10}{"найдено":>9}{"ORM, мс":>10}'
+            f'{"индекс, мс":>12}{"ускорение":>11}'
+        )
+        for query in options['queries']:
+            orm_time = self.measure(orm_search, query, repeat)
+            index_time = self.measure(ingredient_index.search, query, repeat)
+            found = Ingredient.objects.filter(name__icontains=query).count()
+            self.stdout.write(
+                f'{query:<10}{found:>9}{orm_time:>10.3f}'
+                f'{index_time:>12.3f}{orm_time / index_time:>10.1f}x'
+            )
@@ -0,0 +1,258 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+
+import requests
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from rest_framework.authtoken.models import Token
+
+from recipes.models import ShoppingListItem
+
+INTERFACES = ('wsgi', 'asgi')
+READ_MIX = 'recipes=35,recipe=20,subscriptions=15,ingredients=15,tags=15'
+STARTUP_TIMEOUT = 30
+SLOW_CHUNK_SIZE = 1024
+SLOW_CHUNKS = 20
+SLOW_INTERVAL = 0.25
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class SlowBody:
+    """Тело запроса с Content-Length, как у загрузки из браузера,
+    которое уходит по SLOW_CHUNK_SIZE байт раз в SLOW_INTERVAL."""
+
+    def __len__(self):
+        return SLOW_CHUNK_SIZE * SLOW_CHUNKS
+
+    def __iter__(self):
+        for _ in range(SLOW_CHUNKS):
+            time.sleep(SLOW_INTERVAL)
+            yield b' ' * SLOW_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность gunicorn с синхронными '
+        'воркерами (WSGI) и с uvicorn (ASGI) при одинаковом числе '
+        'воркеров и медленных клиентах'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interfaces', nargs='+', choices=INTERFACES,
+            default=INTERFACES,
+        )
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument(
+            '--worker-connections', type=int, default=50,
+            help='Предел одновременных запросов на ASGI-воркер',
+        )
+        parser.add_argument('--clients', type=int, default=16)
+        parser.add_argument(
+            '--slow-clients', type=int, default=4,
+            help='Клиенты, которые медленно отправляют тело запроса '
+                 'или читают выгрузку списка покупок',
+        )
+        parser.add_argument('--duration', type=float, default=20)
+        parser.add_argument('--mix', default=READ_MIX)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--no-data',
+            action='store_true',
+            help='Не создавать синтетические данные, взять имеющиеся',
+        )
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--output', default='benchmark_servers.json')
+
+    def handle(self, *args, **options):
+        if not options['no_data']:
+            call_command(
+                'generate_fake_data',
+                users=options['users'],
+                recipes=options['recipes'],
+                seed=options['seed'],
+                stdout=self.stdout,
+            )
+        slow_tokens = self.slow_tokens(options['slow_clients'])
+        results = {}
+        for interface in options['interfaces']:
+            self.stdout.write(f'Прогон {interface}…')
+            with tempfile.TemporaryDirectory() as workdir, open(
+                os.path.join(workdir, 'gunicorn.log'), 'w+'
+            ) as log:
+                process, url = self.start_server(
+                    interface, options, workdir, log
+                )
+                try:
+                    results[interface] = self.measure(
+                        url, slow_tokens, options, workdir
+                    )
+                finally:
+                    process.terminate()
+                    process.wait(timeout=STARTUP_TIMEOUT)
+        report = {
+            'config': {
+                key: options[key] for key in (
+                    'workers', 'worker_connections', 'clients',
+                    'slow_clients', 'duration', 'mix', 'seed',
+                )
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.print_report(results)
+        self.stdout.write(f'Отчёт сохранён в {options["output"]}')
+
+    def slow_tokens(self, count):
+        user_ids = list(ShoppingListItem.objects.values_list(
+            'user_id', flat=True
+        ).distinct()[:count])
+        if count and not user_ids:
+            raise CommandError('Нет пользователей со списком покупок')
+        return [
+            Token.objects.get_or_create(user_id=user_id)[0].key
+            for user_id in user_ids
+        ]
+
+    def start_server(self, interface, options, workdir, log):
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        process = subprocess.Popen(
+            (sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py'),
+            cwd=settings.BASE_DIR,
+            env={
+                **os.environ,
+                'GUNICORN_INTERFACE': interface,
+                'GUNICORN_BIND': f'127.0.0.1:{port}',
+                'GUNICORN_WORKERS': str(options['workers']),
+                'GUNICORN_WORKER_CONNECTIONS': str(
+                    options['worker_connections']
+                ),
+                'GUNICORN_MAX_REQUESTS': '0',
+                'GUNICORN_ACCESSLOG': '',
+                'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'metrics'),
+            },
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                if requests.get(f'{url}/api/tags/', timeout=1).ok:
+                    return process, url
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        process.kill()
+        process.wait()
+        log.seek(0)
+        raise CommandError(f'gunicorn ({interface}) не запустился:\n'
+                           + log.read()[-2000:])
+
+    def measure(self, url, slow_tokens, options, workdir):
+        stop = threading.Event()
+        slow_done = []
+        threads = [
+            threading.Thread(
+                target=self.slow_client,
+                args=(url, token, number % 2 == 0, stop, slow_done),
+            )
+            for number, token in enumerate(slow_tokens)
+        ]
+        for thread in threads:
+            thread.start()
+        output = os.path.join(workdir, 'load_test.json')
+        try:
+            call_command(
+                'load_test',
+                url=url,
+                no_data=True,
+                clients=options['clients'],
+                duration=options['duration'],
+                mix=options['mix'],
+                seed=options['seed'],
+                output=output,
+                stdout=StringIO(),
+            )
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        with open(output, encoding='utf-8') as file:
+            report = json.load(file)
+        del report['config']
+        report['slow_requests'] = len(slow_done)
+        return report
+
+    @staticmethod
+    def slow_client(url, token, upload, stop, done):
+        """Медленно отправляет тело запроса или медленно читает ответ.
+
+        Синхронный воркер занят таким клиентом целиком, пока тело не
+        передано.
+        """
+        session = requests.Session()
+        session.headers['Authorization'] = f'Token {token}'
+        while not stop.is_set():
+            try:
+                if upload:
+                    session.post(
+                        f'{url}/api/recipes/', data=SlowBody(),
+                        headers={'Content-Type': 'application/json'},
+                    )
+                else:
+                    with session.get(
+                        f'{url}/api/recipes/download_shopping_cart/',
+                        stream=True,
+                    ) as response:
+                        for _ in response.iter_content(SLOW_CHUNK_SIZE):
+                            if stop.is_set():
+                                break
+                            time.sleep(SLOW_INTERVAL)
+            except requests.RequestException:
+                continue
+            done.append(upload)
+
+    def print_report(self, results):
+        self.stdout.write(
+            f'{"":<6}{"запросов":>10}{"ошибок":>8}{"rps":>9}{"p50":>9}'
+            f'{"p95":>9}{"p99":>9}{"медл.":>7}'
+        )
+        for interface, report in results.items():
+            total = report['total']
+            errors = sum(
+                row['errors'] for row in report['endpoints'].values()
+            )
+            self.stdout.write(
+                f'{interface:<6}{total["requests"]:>10}{errors:>8}'
+                f'{total["rps"]:>9.1f}{total["p50_ms"]:>9.1f}'
+                f'{total["p95_ms"]:>9.1f}{total["p99_ms"]:>9.1f}'
+                f'{report["slow_requests"]:>7}'
+            )
+        self.stdout.write('\np95 по сценариям, мс')
+        names = sorted({
+            name for report in results.values() for name in report['endpoints']
+        })
+        self.stdout.write(
+            f'{"сценарий":<18}' + ''.join(f'{key:>9}' for key in results)
+        )
+        for name in names:
+            self.stdout.write(f'{name:<18}' + ''.join(
+                f'{report["endpoints"][name]["p95_ms"]:>9.1f}'
+                if name in report['endpoints'] else f'{"-":>9}'
+                for report in results.values()
+            ))
@@ -0,0 +1,345 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+from django.core.management import BaseCommand, CommandError, call_command
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+DEFAULT_MIX = (
+    'recipes=30,recipes_filtered=15,recipe=10,subscriptions=10,'
+    'ingredients=15,download=5,favorite=10,cart=5'
+)
+SEED_PASSWORD = 'load-test-password'
+REQUEST_ID_HEADER = 'HTTP_X_LOAD_TEST_ID'
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class QueryCountingApplication:
+    """WSGI-обёртка, считающая SQL-запросы каждого запроса.
+
+    Счётчик закрывается только после отдачи тела, поэтому запросы
+    потоковых ответов (выгрузка списка покупок) тоже учитываются.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.queries = {}
+
+    def __call__(self, environ, start_response):
+        request_id = environ.get(REQUEST_ID_HEADER)
+        count = [0]
+
+        def counter(execute, sql, params, many, context):
+            count[0] += 1
+            return execute(sql, params, many, context)
+
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        response = self.application(environ, start_response)
+        try:
+            yield from response
+        finally:
+            response.close()
+            stack.close()
+            connections.close_all()
+            if request_id:
+                self.queries[request_id] = count[0]
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест API на синтетических данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Адрес уже запущенного API; по умолчанию сервер '
+                 'поднимается в этом процессе на настроенной базе',
+        )
+        parser.add_argument('--clients', type=int, default=20)
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument('--mix', default=DEFAULT_MIX)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--no-data',
+            action='store_true',
+            help='Не создавать синтетические данные, взять имеющиеся',
+        )
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--follows', type=int, default=10)
+        parser.add_argument('--favorites', type=int, default=20)
+        parser.add_argument('--carts', type=int, default=5)
+        parser.add_argument('--output', default='load_test.json')
+        parser.add_argument(
+            '--compare', help='JSON прошлого прогона для сравнения'
+        )
+
+    def handle(self, *args, **options):
+        self.mix = self.parse_mix(options['mix'])
+        if not options['no_data']:
+            self.generate(options)
+        self.load_fixtures(options['clients'])
+        server = None
+        self.application = None
+        url = options['url']
+        if url is None:
+            self.application = QueryCountingApplication(
+                get_wsgi_application()
+            )
+            server = make_server(
+                '127.0.0.1', 0, self.application,
+                server_class=ThreadingWSGIServer, handler_class=QuietHandler,
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f'http://127.0.0.1:{server.server_port}'
+        self.url = url.rstrip('/')
+        connections.close_all()
+        try:
+            report = self.run(options)
+        finally:
+            if server is not None:
+                server.shutdown()
+        report['config'] = {
+            key: options[key] for key in (
+                'clients', 'duration', 'mix', 'seed', 'users', 'recipes',
+                'follows', 'favorites', 'carts',
+            )
+        }
+        report['config']['database'] = connection.vendor
+        report['config']['url'] = options['url']
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        previous = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                previous = json.load(file)
+        self.print_report(report, previous)
+        self.stdout.write(f'Отчёт сохранён в {options["output"]}')
+
+    def parse_mix(self, value):
+        mix = {}
+        for item in value.split(','):
+            name, _, weight = item.partition('=')
+            if not hasattr(self, f'scenario_{name.strip()}'):
+                raise CommandError(f'Неизвестный сценарий: {name}')
+            try:
+                mix[name.strip()] = float(weight)
+            except ValueError:
+                raise CommandError(f'Неверный вес сценария: {item}')
+        return mix
+
+    def generate(self, options):
+        call_command(
+            'generate_fake_data',
+            users=options['users'],
+            recipes=options['recipes'],
+            follows_per_user=options['follows'],
+            favorites_per_user=options['favorites'],
+            carts_per_user=options['carts'],
+            seed=options['seed'],
+            password=SEED_PASSWORD,
+            stdout=self.stdout,
+        )
+
+    def load_fixtures(self, clients):
+        user_ids = list(User.objects.filter(
+            follower__isnull=False
+        ).distinct().values_list('id', flat=True)[:max(clients * 5, 50)])
+        if not user_ids:
+            raise CommandError('Нет пользователей с подписками')
+        Token.objects.bulk_create(
+            (
+                Token(user_id=user_id, key=Token.generate_key())
+                for user_id in user_ids
+            ),
+            ignore_conflicts=True,
+        )
+        self.tokens = list(Token.objects.filter(
+            user_id__in=user_ids
+        ).values_list('key', flat=True))
+        self.recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        self.author_ids = list(Recipe.objects.values_list(
+            'author_id', flat=True
+        ).distinct()[:1000])
+        self.tag_slugs = list(Tag.objects.values_list('slug', flat=True))
+        self.ingredient_prefixes = sorted({
+            name[:3] for name in Ingredient.objects.values_list(
+                'name', flat=True
+            )[:1000]
+        })
+        self.recipe_pages = max(1, len(self.recipe_ids) // 6)
+
+    def scenario_recipes(self, rand):
+        page = rand.randint(1, min(self.recipe_pages, 50))
+        return 'GET', f'/api/recipes/?page={page}'
+
+    def scenario_recipes_filtered(self, rand):
+        query = rand.choice((
+            f'tags={rand.choice(self.tag_slugs)}',
+            'is_favorited=1',
+            'is_in_shopping_cart=1',
+            f'author={rand.choice(self.author_ids)}',
+        ))
+        return 'GET', f'/api/recipes/?{query}'
+
+    def scenario_recipe(self, rand):
+        return 'GET', f'/api/recipes/{rand.choice(self.recipe_ids)}/'
+
+    def scenario_subscriptions(self, rand):
+        return 'GET', '/api/users/subscriptions/?recipes_limit=3'
+
+    def scenario_tags(self, rand):
+        return 'GET', '/api/tags/'
+
+    def scenario_ingredients(self, rand):
+        prefix = rand.choice(self.ingredient_prefixes)
+        return 'GET', f'/api/ingredients/?name={prefix}'
+
+    def scenario_download(self, rand):
+        return 'GET', '/api/recipes/download_shopping_cart/'
+
+    def scenario_favorite(self, rand):
+        return 'TOGGLE', (
+            f'/api/recipes/{rand.choice(self.recipe_ids)}/favorite/'
+        )
+
+    def scenario_cart(self, rand):
+        return 'TOGGLE', (
+            f'/api/recipes/{rand.choice(self.recipe_ids)}/shopping_cart/'
+        )
+
+    def run(self, options):
+        results = defaultdict(list)
+        lock = threading.Lock()
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        deadline = time.monotonic() + options['duration']
+        sequence = iter(range(10 ** 12))
+
+        def client(number):
+            rand = random.Random(options['seed'] * 1000 + number)
+            session = requests.Session()
+            session.headers['Authorization'] = (
+                f'Token {self.tokens[number % len(self.tokens)]}'
+            )
+            while time.monotonic() < deadline:
+                name = rand.choices(names, weights)[0]
+                method, path = getattr(self, f'scenario_{name}')(rand)
+                methods = ('POST', 'DELETE') if method == 'TOGGLE' else (
+                    method,
+                )
+                for method in methods:
+                    request_id = str(next(sequence))
+                    started = time.perf_counter()
+                    try:
+                        response = session.request(
+                            method, self.url + path,
+                            headers={'X-Load-Test-Id': request_id},
+                        )
+                        status = response.status_code
+                    except requests.RequestException:
+                        status = None
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with lock:
+                        results[name].append((request_id, elapsed, status))
+
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=client, args=(number,))
+            for number in range(options['clients'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.summarize(results, time.monotonic() - started)
+
+    def summarize(self, results, elapsed):
+        queries = self.application.queries if self.application else {}
+        endpoints = {}
+        everything = []
+        for name, rows in sorted(results.items()):
+            latencies = [latency for _, latency, _ in rows]
+            everything.extend(latencies)
+            counts = [
+                queries[request_id] for request_id, _, _ in rows
+                if request_id in queries
+            ]
+            endpoints[name] = {
+                'requests': len(rows),
+                'errors': sum(
+                    1 for _, _, status in rows
+                    if status is None or status >= 500
+                ),
+                'rps': round(len(rows) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'queries_per_request': (
+                    round(sum(counts) / len(counts), 2) if counts else None
+                ),
+            }
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'total': {
+                'requests': len(everything),
+                'rps': round(len(everything) / elapsed, 2),
+                'p50_ms': round(percentile(everything, 0.50), 2),
+                'p95_ms': round(percentile(everything, 0.95), 2),
+                'p99_ms': round(percentile(everything, 0.99), 2),
+            },
+            'endpoints': endpoints,
+        }
+
+    def print_report(self, report, previous=None):
+        previous = (previous or {}).get('endpoints', {})
+        self.stdout.write(
+            f'{"сценарий":<18}{"запросов":>9}{"ошибок":>8}{"rps":>9}'
+            f'{"p50":>9}{"p95":>9}{"p99":>9}{"SQL":>7}'
+        )
+        for name, row in report['endpoints'].items():
+            queries = row['queries_per_request']
+            line = (
+                f'{name:<18}{row["requests"]:>9}{row["errors"]:>8}'
+                f'{row["rps"]:>9.1f}{row["p50_ms"]:>9.1f}'
+                f'{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}'
+                f'{queries if queries is not None else "-":>7}'
+            )
+            if name in previous:
+                change = (
+                    row['p95_ms'] / previous[name]['p95_ms'] - 1
+                ) * 100
+                line += f'  p95 {change:+.0f}%'
+            self.stdout.write(line)
+        total = report['total']
+        self.stdout.write(
+            f'Всего {total["requests"]} запросов, {total["rps"]:.1f} rps'
+        )
@@ -0,0 +1,120 @@
+import json
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from foodgram.slow_queries import LOG_FILE_PREFIX
+
+SORT_KEYS = ('total', 'count', 'mean', 'p95', 'max')
+SQL_PREVIEW_LENGTH = 300
+CALL_SITES_SHOWN = 3
+
+
+def aware_datetime(value):
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+class Command(BaseCommand):
+    help = 'Сводка журнала медленных запросов по отпечаткам SQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            default=settings.SLOW_QUERY_DIR,
+            help='Каталог журнала, по умолчанию SLOW_QUERY_DIR',
+        )
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--sort', choices=SORT_KEYS, default='total')
+        parser.add_argument(
+            '--since', type=aware_datetime,
+            help='Учитывать записи не старше, например 2024-01-31T12:00 '
+                 '(UTC, если пояс не указан)',
+        )
+        parser.add_argument(
+            '--plans',
+            action='store_true',
+            help='Показать план самого медленного запроса с EXPLAIN',
+        )
+
+    def handle(self, *args, **options):
+        if not options['dir']:
+            raise CommandError('Укажите --dir или SLOW_QUERY_DIR')
+        files = sorted(Path(options['dir']).glob(f'{LOG_FILE_PREFIX}-*'))
+        if not files:
+            raise CommandError(f'В {options["dir"]} нет журналов')
+        groups = defaultdict(list)
+        skipped = 0
+        for path in files:
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    if (
+                        options['since']
+                        and datetime.fromisoformat(entry['time'])
+                        < options['since']
+                    ):
+                        continue
+                    groups[entry['fingerprint']].append(entry)
+        summaries = sorted(
+            (self.summarize(entries) for entries in groups.values()),
+            key=lambda summary: summary[options['sort']],
+            reverse=True,
+        )
+        self.stdout.write(
+            f'Файлов: {len(files)}, отпечатков: {len(summaries)}, '
+            f'записей: {sum(len(entries) for entries in groups.values())}'
+            + (f', повреждённых строк: {skipped}' if skipped else '')
+        )
+        for rank, summary in enumerate(summaries[:options['top']], 1):
+            self.print_summary(rank, summary, options['plans'])
+
+    @staticmethod
+    def summarize(entries):
+        durations = sorted(entry['duration_ms'] for entry in entries)
+        planned = [entry for entry in entries if entry.get('plan')]
+        return {
+            'fingerprint': entries[0]['fingerprint'],
+            'sql': entries[0]['sql'],
+            'count': len(durations),
+            'total': sum(durations),
+            'mean': sum(durations) / len(durations),
+            'p95': durations[min(
+                len(durations) - 1, int(0.95 * len(durations))
+            )],
+            'max': durations[-1],
+            'call_sites': Counter(
+                entry['call_site'] or '?' for entry in entries
+            ),
+            'plan': max(
+                planned, key=lambda entry: entry['duration_ms']
+            )['plan'] if planned else None,
+        }
+
+    def print_summary(self, rank, summary, show_plan):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'\n#{rank} {summary["fingerprint"]}: {summary["count"]} раз, '
+            f'всего {summary["total"]:.0f} мс, '
+            f'среднее {summary["mean"]:.1f}, p95 {summary["p95"]:.1f}, '
+            f'макс. {summary["max"]:.1f} мс'
+        ))
+        for call_site, count in summary['call_sites'].most_common(
+            CALL_SITES_SHOWN
+        ):
+            self.stdout.write(f'  {count:>6} × {call_site}')
+        sql = summary['sql']
+        if len(sql) > SQL_PREVIEW_LENGTH:
+            sql = sql[:SQL_PREVIEW_LENGTH] + '…'
+        self.stdout.write(f'  {sql}')
+        if show_plan and summary['plan']:
+            for line in summary['plan'].splitlines():
+                self.stdout.write(f'    {line}')
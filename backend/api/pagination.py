@@ -1,5 +1,202 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       _positive_int)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from recipes.models import FeedEntry
+
+from .constants import (KEYSET_DEFAULT_ORDERING, KEYSET_INCOMPATIBLE_PARAMS,
+                        KEYSET_MODE, PAGINATION_MODE_QUERY_PARAM)
+
+
+class KeysetPaginator(BasePagination):
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(
+            view, 'keyset_ordering', KEYSET_DEFAULT_ORDERING
+        )
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+        self.count = None
+        if request.query_params.get(self.count_query_param) != 'false':
+            self.count = queryset.count()
+        ordering = (
+            [self.invert(field) for field in self.ordering]
+            if reverse else list(self.ordering)
+        )
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                self.position_filter(ordering, position)
+            )
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def position_filter(ordering, position):
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_position(self, instance):
+        return [
+            instance._meta.get_field(field.lstrip('-')).value_to_string(
+                instance
+            )
+            for field in self.ordering
+        ]
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(b64decode(encoded.encode()).decode())
+            position = cursor['p']
+            reverse = bool(cursor.get('r'))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.position_value(model, field, value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (
+            BinasciiError, KeyError, TypeError, ValueError, ValidationError
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def position_value(model, field, value):
+        """Значение позиции курсора, приведённое к типу поля сортировки."""
+        if value is None:
+            raise ValueError
+        return model._meta.get_field(field.lstrip('-')).to_python(value)
+
+    def encode_cursor(self, position, reverse):
+        cursor = {'p': position}
+        if reverse:
+            cursor['r'] = 1
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            b64encode(json.dumps(cursor).encode()).decode()
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), True)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
 
 
 class LimitPaginator(PageNumberPagination):
+    """Постраничная пагинация с курсорным режимом по ?pagination=cursor.
+
+    Курсор задаёт свою сортировку, поэтому с поиском по релевантности
+    или параметром ordering запрос остаётся постраничным.
+    """
+
     page_size_query_param = 'limit'
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        mode = request.query_params.get(PAGINATION_MODE_QUERY_PARAM)
+        if mode == KEYSET_MODE and not any(
+            request.query_params.get(param)
+            for param in KEYSET_INCOMPATIBLE_PARAMS
+        ):
+            self.keyset = KeysetPaginator(self.page_size)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FeedPaginator(KeysetPaginator):
+    """Курсорная пагинация ленты подписок: только вперёд и без count.
+
+    Страница берётся из FeedEntry.objects.timeline, а переданный
+    queryset рецептов лишь догружает найденные рецепты.
+    """
+
+    def __init__(self):
+        super().__init__(api_settings.PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = KEYSET_DEFAULT_ORDERING
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+        if reverse:
+            raise NotFound(self.invalid_cursor_message)
+        self.count = None
+        ids = FeedEntry.objects.timeline(
+            request.user, position, self.page_size + 1
+        )
+        recipes = queryset.in_bulk(ids[:self.page_size])
+        self.page = [recipes[pk] for pk in ids if pk in recipes]
+        self.has_next = len(ids) > self.page_size
+        self.has_previous = False
+        return self.page
@@ -0,0 +1,80 @@
+import json
+import threading
+from bisect import bisect_left
+
+from recipes.models import Ingredient
+from .cache import ingredients_cache
+
+
+def normalize(value):
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Строится при первом обращении и перестраивается, когда меняется
+    поколение справочника ингредиентов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+
+    def _build(self):
+        entries = sorted(
+            (normalize(name), pk, json.dumps(
+                {
+                    'id': pk,
+                    'name': name,
+                    'measurement_unit': measurement_unit,
+                },
+                ensure_ascii=False,
+                separators=(',', ':')
+            ).encode())
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        return (
+            [key for key, _, _ in entries],
+            [row for _, _, row in entries],
+        )
+
+    def _get_data(self):
+        generation = ingredients_cache.generation()
+        data = self._data
+        if data is None or data[0] != generation:
+            with self._lock:
+                if self._data is None or self._data[0] != generation:
+                    self._data = (generation, *self._build())
+                data = self._data
+        return data[1:]
+
+    def search(self, query):
+        keys, rows = self._get_data()
+        query = normalize(query or '')
+        if not query:
+            return self.render(rows)
+        start = end = bisect_left(keys, query)
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        substring = sorted(
+            (key.find(query), position)
+            for position, key in enumerate(keys)
+            if not start <= position < end and query in key
+        )
+        return self.render(
+            rows[start:end] + [rows[position] for _, position in substring]
+        )
+
+    @staticmethod
+    def render(rows):
+        return b'[' + b','.join(rows) + b']'
+
+
+ingredient_index = IngredientIndex()
@@ -1,25 +1,37 @@
+from collections import Counter
+
 import django.core.validators as validators
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.utils.functional import cached_property
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
 from .constants import MIN_INGREDIENT_AMOUNT
+from .utils import format_ids, get_followed_authors
 from recipes.constants import COOKING_TIME_MIN_VALUE
+from recipes.images import variant_urls
 from recipes.models import (Favorite, Ingredient, IngredientMeasure,
-                            Recipe, ShoppingCart, Tag)
+                            Recipe, ShoppingCart, ShoppingListItem, Tag)
 from users.models import Follow
 
 User = get_user_model()
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
+class ImageVariantsMixin(serializers.Serializer):
+    image_variants = serializers.SerializerMethodField()
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants, self.context.get('request'))
+
+
+class ShortRecipeSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     image = Base64ImageField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -35,9 +47,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class IngredientCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(
         write_only=True,
     )
@@ -93,14 +103,12 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        return (
-            user.is_authenticated
-            and obj.following.filter(user=user).exists()
-        )
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_followed_authors(self.context['request'])
 
 
-class ShowRecipeSerializer(serializers.ModelSerializer):
+class ShowRecipeSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = UserSerializer(read_only=True)
     ingredients = IngredientMeasureSerializer(
@@ -112,9 +120,35 @@ class ShowRecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        fields = (
+            'id',
+            'tags',
+            'author',
+            'ingredients',
+            'is_favorited',
+            'is_in_shopping_cart',
+            'name',
+            'image',
+            'image_variants',
+            'text',
+            'cooking_time',
+            'pub_date',
+        )
+
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        data = super().to_representation(instance)
+        if hasattr(instance, 'name_highlight'):
+            data['highlight'] = {
+                'name': instance.name_highlight,
+                'text': instance.text_highlight,
+            }
+        return data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         return (
             user.is_authenticated
@@ -122,6 +156,8 @@ class ShowRecipeSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         return (
             user.is_authenticated
@@ -131,27 +167,29 @@ class ShowRecipeSerializer(serializers.ModelSerializer):
 
 class FollowSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
         fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        queryset = obj.recipes.all()
-        if limit:
-            try:
-                limit_integer = int(limit)
-                queryset = queryset[:limit_integer]
-            except TypeError as err:
-                raise serializers.ValidationError(f'Value must be int {err}')
+        if hasattr(obj, 'limited_recipes'):
+            queryset = obj.limited_recipes
+        else:
+            request = self.context.get('request')
+            limit = request.GET.get('recipes_limit')
+            queryset = obj.recipes.all()
+            if limit:
+                try:
+                    limit_integer = int(limit)
+                    queryset = queryset[:limit_integer]
+                except ValueError as err:
+                    raise serializers.ValidationError(
+                        f'Value must be int {err}'
+                    )
         return ShortRecipeSerializer(queryset, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class SubscribeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -171,9 +209,7 @@ class SubscribeSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
     author = UserSerializer(read_only=True)
     ingredients = IngredientCreateSerializer(many=True)
     cooking_time = serializers.IntegerField(
@@ -198,33 +234,54 @@ class RecipeSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    @staticmethod
+    def resolve_ids(model, ids, errors, field, duplicate_message):
+        duplicates = sorted(
+            pk for pk, count in Counter(ids).items() if count > 1
+        )
+        if duplicates:
+            errors.setdefault(field, []).append(
+                f'{duplicate_message}: {format_ids(duplicates)}'
+            )
+        objects = model.objects.in_bulk(set(ids))
+        missing = sorted(set(ids) - objects.keys())
+        if missing:
+            errors.setdefault(field, []).append(
+                f'Не найдены объекты с id: {format_ids(missing)}'
+            )
+        return objects
+
     def validate(self, data):
-        tags_arr = self.initial_data.get('tags')
-        if not tags_arr:
+        tag_ids = data.get('tags')
+        if not tag_ids:
             raise serializers.ValidationError('Не указаны тэги')
-        if len(tags_arr) != len(set(tags_arr)):
-            raise serializers.ValidationError('Теги повторяются')
-        ingredients = self.initial_data.get('ingredients')
+        ingredients = data.get('ingredients')
         if not ingredients:
             raise serializers.ValidationError({
                 'ingredients': 'Необходим ингридиент'})
-        ingredient_array = []
-        for ingredient_item in ingredients:
-            ingredient = get_object_or_404(
-                Ingredient,
-                id=ingredient_item['id']
+        errors = {}
+        tags = self.resolve_ids(
+            Tag, tag_ids, errors, 'tags', 'Теги повторяются'
+        )
+        ingredient_ids = [ingredient['id'] for ingredient in ingredients]
+        ingredient_objects = self.resolve_ids(
+            Ingredient, ingredient_ids, errors, 'ingredients',
+            'Ингридиенты повторяются'
+        )
+        small_amounts = sorted(
+            ingredient['id'] for ingredient in ingredients
+            if ingredient['amount'] <= MIN_INGREDIENT_AMOUNT
+        )
+        if small_amounts:
+            errors.setdefault('ingredients', []).append(
+                'Масса ингридиента не может быть меньше нуля: '
+                f'{format_ids(small_amounts)}'
             )
-            if ingredient in ingredient_array:
-                raise serializers.ValidationError(
-                    'Ингридиенты повторяются'
-                )
-            ingredient_array.append(ingredient)
-            if int(ingredient_item['amount']) <= MIN_INGREDIENT_AMOUNT:
-                raise serializers.ValidationError({
-                    'ingredients': (
-                        'Масса ингридиента не может быть меньше нуля'
-                    )
-                })
+        if errors:
+            raise serializers.ValidationError(errors)
+        data['tags'] = [tags[pk] for pk in tag_ids]
+        for ingredient in ingredients:
+            ingredient['id'] = ingredient_objects[ingredient['id']]
         return data
 
     def create_ingredients(self, ingredients, recipe):
@@ -247,21 +304,90 @@ class RecipeSerializer(serializers.ModelSerializer):
         self.create_ingredients(ingredients_data, recipe)
         return recipe
 
+    def update_ingredients(self, instance, ingredients):
+        current = {
+            measure.ingredient_id: measure
+            for measure in instance.ingredient_amount.all()
+        }
+        old_amounts = {
+            ingredient_id: measure.amount
+            for ingredient_id, measure in current.items()
+        }
+        new_amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = [
+            measure.id for ingredient_id, measure in current.items()
+            if ingredient_id not in new_amounts
+        ]
+        changed = []
+        added = []
+        for ingredient_id, amount in new_amounts.items():
+            measure = current.get(ingredient_id)
+            if measure is None:
+                added.append(IngredientMeasure(
+                    recipe=instance,
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                ))
+            elif measure.amount != amount:
+                measure.amount = amount
+                changed.append(measure)
+        if removed:
+            IngredientMeasure.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientMeasure.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientMeasure.objects.bulk_create(added)
+        return old_amounts, new_amounts
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        super().update(instance, validated_data)
-        instance.tags.clear()
+        if 'image' in validated_data:
+            validated_data['image_variants'] = None
+        old_image, old_variants = instance.image.name, instance.image_variants
+        changed_fields = [
+            field for field, value in validated_data.items()
+            if getattr(instance, field) != value
+        ]
+        tags_changed = (
+            {tag.id for tag in instance.tags.all()}
+            != {tag.id for tag in tags}
+        )
         instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_ingredients(ingredients, instance)
-        instance.save()
+        old_amounts, new_amounts = self.update_ingredients(
+            instance, ingredients
+        )
+        if tags_changed or old_amounts.keys() != new_amounts.keys():
+            validated_data['similar_outdated'] = True
+            changed_fields.append('similar_outdated')
+        for field in changed_fields:
+            setattr(instance, field, validated_data[field])
+        if changed_fields:
+            instance.save(update_fields=changed_fields)
+        if 'image' in changed_fields:
+            transaction.on_commit(
+                lambda: Recipe.objects.delete_unused_variants(
+                    old_image, old_variants
+                )
+            )
+        ShoppingListItem.objects.change_recipe(
+            instance, old_amounts, new_amounts
+        )
         return instance
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        if not hasattr(instance, 'is_favorited') and request is not None:
+            instance = Recipe.objects.with_related().with_user_flags(
+                request.user
+            ).get(pk=instance.pk)
         return ShowRecipeSerializer(
             instance,
-            context={'request': self.context.get('request')},
+            context={'request': request},
         ).data
 
 
@@ -292,6 +418,18 @@ class RecipeListSerializer(RecipeSerializer):
             'cooking_time',
         )
 
+    def to_representation(self, instance):
+        if not hasattr(instance, 'is_favorited'):
+            return super().to_representation(instance)
+        return self.show_serializer.to_representation(instance)
+
+    @cached_property
+    def show_serializer(self):
+        """Один ShowRecipeSerializer на весь список: поля строятся раз."""
+        return ShowRecipeSerializer(
+            context={'request': self.context.get('request')}
+        )
+
 
 class FavoriteSerializer(serializers.ModelSerializer):
 
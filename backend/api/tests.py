@@ -0,0 +1,717 @@
+import gzip
+import json
+import re
+import tempfile
+from base64 import b64encode
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from PIL import Image
+from rest_framework.test import APIClient, APITestCase
+
+from recipes.constants import SEARCH_FTS_TABLE
+from recipes.images import build_variants, variant_files
+from recipes.models import (Favorite, FeedEntry, Ingredient,
+                            IngredientMeasure, Recipe, ShoppingCart,
+                            ShoppingListItem, ShoppingListItemQuerySet, Tag)
+from users.models import Follow, User
+from .utils import change_counter
+
+RECIPES_PER_AUTHOR = 4
+
+
+class ApiTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create(
+            email='viewer@example.com', username='viewer',
+            first_name='Зритель', last_name='Тест',
+        )
+        cls.authors = [
+            User.objects.create(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Автор', last_name=str(i),
+            )
+            for i in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'тег {i}', slug=f'tag-{i}', color=f'#00000{i}'
+            )
+            for i in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {i}', measurement_unit='г'
+            )
+            for i in range(3)
+        ]
+        cls.recipes = []
+        for author in cls.authors:
+            for i in range(RECIPES_PER_AUTHOR):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'рецепт {i}', text='описание',
+                    cooking_time=10, image='recipes/test.png',
+                )
+                recipe.tags.set(cls.tags)
+                IngredientMeasure.objects.bulk_create(
+                    IngredientMeasure(
+                        recipe=recipe, ingredient=ingredient, amount=i + 1
+                    )
+                    for ingredient in cls.ingredients
+                )
+                cls.recipes.append(recipe)
+        for author in cls.authors[:2]:
+            Follow.objects.create(user=cls.viewer, author=author)
+        for recipe in cls.recipes[::2]:
+            Favorite.objects.create(user=cls.viewer, recipe=recipe)
+        for recipe in cls.recipes[::3]:
+            ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+
+class QueryCountTests(ApiTestCase):
+    """Число SQL-запросов не зависит от размера страницы.
+
+    В запросы к рецептам входит выборка вариантов фильтра tags.
+    """
+
+    def assert_page_queries(self, url, queries, sizes=(1, 6)):
+        for size in sizes:
+            with self.subTest(limit=size), self.assertNumQueries(queries):
+                response = self.client.get(url, {'limit': size})
+            self.assertEqual(response.status_code, 200)
+
+    def test_recipe_list(self):
+        self.assert_page_queries('/api/recipes/', 5)
+
+    def test_recipe_list_anonymous(self):
+        self.client.force_authenticate(None)
+        self.assert_page_queries('/api/recipes/', 5)
+
+    def test_recipe_detail(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{self.recipes[0].id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_subscriptions(self):
+        self.assert_page_queries(
+            '/api/users/subscriptions/?recipes_limit=2', 3
+        )
+
+    def test_users_list(self):
+        self.assert_page_queries('/api/users/', 3)
+
+    def test_favorited_and_cart_filters(self):
+        for query in ('is_favorited=1', 'is_in_shopping_cart=1'):
+            with self.subTest(query=query):
+                self.assert_page_queries(f'/api/recipes/?{query}', 5)
+
+    def test_user_flags(self):
+        response = self.client.get('/api/recipes/', {'limit': 20})
+        favorited = {recipe.id for recipe in self.recipes[::2]}
+        in_cart = {recipe.id for recipe in self.recipes[::3]}
+        followed = {author.id for author in self.authors[:2]}
+        for recipe in response.data['results']:
+            self.assertEqual(
+                recipe['is_favorited'], recipe['id'] in favorited
+            )
+            self.assertEqual(
+                recipe['is_in_shopping_cart'], recipe['id'] in in_cart
+            )
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['id'] in followed,
+            )
+
+
+def encode_cursor(cursor):
+    return b64encode(json.dumps(cursor).encode()).decode()
+
+
+class CursorTests(ApiTestCase):
+    """Подделанный курсор даёт 404, а не 500."""
+
+    TAMPERED = (
+        {'p': [1, 2]},
+        {'p': ['x', 'y']},
+        {'p': [None, None]},
+        {'p': [[1], {'a': 1}]},
+        {'p': 'ab'},
+        {'p': [1, 2, 3]},
+        ['x', 'y'],
+        'cursor',
+    )
+
+    def assert_tampered_cursors_rejected(self, url, **params):
+        for cursor in (*map(encode_cursor, self.TAMPERED), 'не base64'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(url, {**params, 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_recipe_list(self):
+        self.assert_tampered_cursors_rejected(
+            '/api/recipes/', pagination='cursor'
+        )
+
+    def test_subscriptions(self):
+        self.assert_tampered_cursors_rejected(
+            '/api/users/subscriptions/', pagination='cursor'
+        )
+
+    def test_next_link_pages_through_recipes(self):
+        url = '/api/recipes/?pagination=cursor&limit=5'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(
+            seen, sorted((recipe.id for recipe in self.recipes), reverse=True)
+        )
+
+    def test_ordering_disables_cursor_mode(self):
+        response = self.client.get('/api/recipes/', {
+            'pagination': 'cursor', 'ordering': 'pub_date', 'limit': 20,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [recipe.id for recipe in self.recipes],
+        )
+
+    def test_search_disables_cursor_mode(self):
+        response = self.client.get('/api/recipes/', {
+            'pagination': 'cursor', 'search': 'рецепт', 'limit': 5,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], len(self.recipes))
+        self.assertIn('page=2', response.data['next'])
+
+    def test_feed(self):
+        self.assert_tampered_cursors_rejected('/api/recipes/feed/')
+
+    def test_feed_rejects_reverse_cursor(self):
+        recipe = self.recipes[-1]
+        response = self.client.get('/api/recipes/feed/', {
+            'cursor': encode_cursor({
+                'p': [recipe.pub_date.isoformat(), recipe.id], 'r': 1,
+            }),
+        })
+        self.assertEqual(response.status_code, 404)
+
+    def test_feed_next_link_pages_through_followed_authors(self):
+        Recipe.objects.update(fanned_out=True)
+        FeedEntry.objects.fill(Follow.objects.filter(user=self.viewer))
+        url = '/api/recipes/feed/?limit=3'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, sorted(
+            (
+                recipe.id for recipe in self.recipes
+                if recipe.author in self.authors[:2]
+            ),
+            reverse=True,
+        ))
+
+
+class SubscriptionsTests(ApiTestCase):
+
+    def test_user_without_subscriptions(self):
+        self.client.force_authenticate(self.authors[2])
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 3}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+    def test_recipes_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 2)
+
+
+class RecipeTests(ApiTestCase):
+
+    def test_recipe_fields(self):
+        response = self.client.get(f'/api/recipes/{self.recipes[0].id}/')
+        self.assertEqual(set(response.data), {
+            'id', 'tags', 'author', 'ingredients', 'is_favorited',
+            'is_in_shopping_cart', 'name', 'image', 'image_variants', 'text',
+            'cooking_time', 'pub_date',
+        })
+
+
+def pdf_lines(pdf):
+    """Строки PDF, восстановленные по ToUnicode встроенного шрифта."""
+    chars = {
+        glyph: chr(int(code, 16))
+        for glyph, code in re.findall(rb'<([0-9A-F]{4})> <([0-9A-F]{4})>', pdf)
+    }
+    return [
+        ''.join(
+            chars[line[start:start + 4]] for start in range(0, len(line), 4)
+        )
+        for line in re.findall(rb"<([0-9A-F]*)> '", pdf)
+    ]
+
+
+class ShoppingListTests(ApiTestCase):
+    """Итоги списка покупок меняются вместе с корзиной и рецептами."""
+
+    def setUp(self):
+        super().setUp()
+        self.buyer = self.authors[2]
+        self.client.force_authenticate(self.buyer)
+
+    def totals(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.buyer
+        ).values_list('ingredient_id', 'total_amount'))
+
+    def cart_url(self, recipe):
+        return f'/api/recipes/{recipe.id}/shopping_cart/'
+
+    def test_add_and_remove_recipes(self):
+        first, second = self.recipes[8], self.recipes[9]
+        for recipe in (first, second):
+            response = self.client.post(self.cart_url(recipe))
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.totals(), {
+            ingredient.id: 3 for ingredient in self.ingredients
+        })
+        response = self.client.delete(self.cart_url(second))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(), {
+            ingredient.id: 1 for ingredient in self.ingredients
+        })
+        self.client.delete(self.cart_url(first))
+        self.assertEqual(self.totals(), {})
+
+    def test_recipe_edit_changes_totals(self):
+        recipe = self.recipes[8]
+        self.client.post(self.cart_url(recipe))
+        kept, changed, removed = self.ingredients
+        added = Ingredient.objects.create(
+            name='ингредиент 3', measurement_unit='г'
+        )
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {
+                'tags': [tag.id for tag in self.tags],
+                'ingredients': [
+                    {'id': kept.id, 'amount': 1},
+                    {'id': changed.id, 'amount': 5},
+                    {'id': added.id, 'amount': 2},
+                ],
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.totals(), {kept.id: 1, changed.id: 5, added.id: 2}
+        )
+        self.assertEqual(
+            list(ShoppingListItem.objects.live_totals().filter(
+                user_id=self.buyer.id
+            ).order_by('ingredient_id').values_list(
+                'ingredient_id', 'total_amount'
+            )),
+            sorted(self.totals().items()),
+        )
+
+    def download(self, file_format):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': file_format}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            f'{self.buyer.username}_shopping_list.{file_format}',
+            response['Content-Disposition'],
+        )
+        return b''.join(response.streaming_content)
+
+    def test_download(self):
+        self.client.post(self.cart_url(self.recipes[9]))
+        lines = [
+            f'ингредиент {i} - 2 г' for i in reversed(range(3))
+        ]
+        self.assertEqual(
+            self.download('txt').decode(),
+            ''.join(f'{line}\n' for line in ['Список покупок:', *lines]),
+        )
+        self.assertEqual(
+            self.download('csv').decode().splitlines(),
+            ['name,amount,measurement_unit'] + [
+                f'ингредиент {i},2,г' for i in reversed(range(3))
+            ],
+        )
+        pdf = self.download('pdf')
+        self.assertTrue(pdf.startswith(b'%PDF-'))
+        self.assertIn(b'/FontFile2', pdf)
+        self.assertEqual(pdf_lines(pdf), ['Список покупок:', *lines])
+
+    def test_insert_is_retried_after_concurrent_delete(self):
+        bulk_create = ShoppingListItemQuerySet.bulk_create
+        calls = []
+
+        def lost_insert(queryset, objs, *args, **kwargs):
+            # Первая вставка будто бы пропущена из-за существующей
+            # позиции, которую другой запрос удалил до блокировки.
+            calls.append(objs)
+            if len(calls) == 1:
+                list(objs)
+                return []
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(
+            ShoppingListItemQuerySet, 'bulk_create', lost_insert
+        ):
+            self.client.post(self.cart_url(self.recipes[9]))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.totals(), {
+            ingredient.id: 2 for ingredient in self.ingredients
+        })
+
+
+class ReferenceCacheTests(ApiTestCase):
+    url = '/api/tags/'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def get(self, accept_encoding='', etag=None):
+        headers = {'HTTP_ACCEPT_ENCODING': accept_encoding}
+        if etag is not None:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.get(self.url, **headers)
+
+    def test_etag_depends_on_encoding(self):
+        compressed = self.get('gzip, deflate')
+        plain = self.get('identity')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(
+            gzip.decompress(compressed.content), plain.content
+        )
+        self.assertEqual(compressed['ETag'], plain['ETag'][:-1] + '-gz"')
+        self.assertEqual(
+            self.get('identity', compressed['ETag']).status_code, 200
+        )
+
+    def test_not_modified(self):
+        for accept_encoding in ('gzip', ''):
+            with self.subTest(accept_encoding=accept_encoding):
+                etag = self.get(accept_encoding)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.get(accept_encoding, etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+    def test_gzip_refused_with_zero_weight(self):
+        for accept_encoding in ('gzip;q=0, identity', 'br, *;q=0'):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.get(accept_encoding)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(
+                    {tag['id'] for tag in json.loads(response.content)},
+                    {tag.id for tag in self.tags},
+                )
+
+    def test_write_invalidates_response(self):
+        etag = self.get('gzip')['ETag']
+        tag = Tag.objects.create(name='новый', slug='new', color='#000010')
+        response = self.get('gzip', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(
+            tag.id,
+            [item['id'] for item in json.loads(
+                gzip.decompress(response.content)
+            )],
+        )
+
+
+class RecipeUpdateTests(ApiTestCase):
+    """Правка рецепта меняет только изменившиеся связи."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[0]
+        self.client.force_authenticate(self.recipe.author)
+
+    def patch(self, ingredients, tags=None, **fields):
+        return self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {
+                'tags': [tag.id for tag in tags or self.tags],
+                'ingredients': ingredients,
+                'name': self.recipe.name,
+                'text': self.recipe.text,
+                'cooking_time': self.recipe.cooking_time,
+                **fields,
+            },
+            format='json',
+        )
+
+    def measures(self):
+        return {
+            measure.ingredient_id: (measure.id, measure.amount)
+            for measure in self.recipe.ingredient_amount.all()
+        }
+
+    def test_only_changed_ingredients_are_written(self):
+        before = self.measures()
+        kept, changed, removed = self.ingredients
+        added = Ingredient.objects.create(
+            name='ингредиент 3', measurement_unit='г'
+        )
+        response = self.patch(
+            [
+                {'id': kept.id, 'amount': 1},
+                {'id': changed.id, 'amount': 7},
+                {'id': added.id, 'amount': 2},
+            ],
+            tags=self.tags[:1],
+        )
+        self.assertEqual(response.status_code, 200)
+        after = self.measures()
+        self.assertEqual(set(after), {kept.id, changed.id, added.id})
+        self.assertEqual(after[kept.id], before[kept.id])
+        self.assertEqual(after[changed.id], (before[changed.id][0], 7))
+        self.assertEqual(after[added.id][1], 2)
+        self.assertEqual(
+            list(self.recipe.tags.values_list('id', flat=True)),
+            [self.tags[0].id],
+        )
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.similar_outdated)
+
+    def test_name_change_keeps_ingredients(self):
+        Recipe.objects.filter(id=self.recipe.id).update(
+            similar_outdated=False
+        )
+        before = self.measures()
+        response = self.patch(
+            [
+                {'id': ingredient.id, 'amount': 1}
+                for ingredient in self.ingredients
+            ],
+            name='новое название',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.measures(), before)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'новое название')
+        self.assertFalse(self.recipe.similar_outdated)
+
+    def test_new_image_deletes_old_variants(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        buffer = BytesIO()
+        Image.new('RGB', (32, 16)).save(buffer, 'PNG')
+        image = 'data:image/png;base64,' + b64encode(
+            buffer.getvalue()
+        ).decode()
+        with override_settings(MEDIA_ROOT=media.name):
+            variants = build_variants(
+                default_storage.save('recipes/old.png', ContentFile(
+                    buffer.getvalue()
+                ))
+            )
+            Recipe.objects.filter(id=self.recipe.id).update(
+                image='recipes/old.png', image_variants=variants
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.patch(
+                    [
+                        {'id': ingredient.id, 'amount': 1}
+                        for ingredient in self.ingredients
+                    ],
+                    image=image,
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any(
+                map(default_storage.exists, variant_files(variants))
+            ))
+        self.recipe.refresh_from_db()
+        self.assertIsNone(self.recipe.image_variants)
+
+    def test_duplicate_and_unknown_ids(self):
+        ingredient = self.ingredients[0]
+        response = self.patch(
+            [
+                {'id': ingredient.id, 'amount': 1},
+                {'id': ingredient.id, 'amount': 2},
+                {'id': 0, 'amount': 1},
+            ],
+            tags=[self.tags[0], self.tags[0]],
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['ingredients'], [
+            f'Ингридиенты повторяются: {ingredient.id}',
+            'Не найдены объекты с id: 0',
+        ])
+        self.assertEqual(
+            response.data['tags'], [f'Теги повторяются: {self.tags[0].id}']
+        )
+        self.assertEqual(len(self.measures()), len(self.ingredients))
+
+    def test_validation_queries_do_not_depend_on_ingredients(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'новый {i}', measurement_unit='г')
+            for i in range(10)
+        )
+        ingredients = list(Ingredient.objects.filter(name__startswith='новый'))
+        for count in (1, 10):
+            payload = [
+                {'id': ingredient.id, 'amount': 0}
+                for ingredient in ingredients[:count]
+            ]
+            with self.subTest(count=count), self.assertNumQueries(4):
+                response = self.patch(payload)
+            self.assertEqual(response.status_code, 400)
+
+
+class RecipeSearchTests(ApiTestCase):
+    """Полнотекстовый поиск; в тестах это FTS5 в SQLite."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        author = cls.authors[0]
+        cls.borscht = Recipe.objects.create(
+            author=author, name='Борщ украинский', text='свёкла и капуста',
+            cooking_time=10, image='recipes/test.png',
+        )
+        cls.salad = Recipe.objects.create(
+            author=author, name='Салат', text='варёная свекла и борщевик',
+            cooking_time=10, image='recipes/test.png',
+        )
+
+    def search(self, value, **params):
+        response = self.client.get(
+            '/api/recipes/', {'search': value, 'limit': 10, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def ids(self, value):
+        return [recipe['id'] for recipe in self.search(value)]
+
+    def test_prefix_and_yo_folding(self):
+        self.assertEqual(
+            set(self.ids('свекл')), {self.borscht.id, self.salad.id}
+        )
+        self.assertEqual(self.ids('свёкла капуста'), [self.borscht.id])
+        self.assertEqual(self.ids('пицца'), [])
+        self.assertEqual(self.ids('!!!'), [])
+
+    def test_highlight(self):
+        recipe, = self.search('капуста', highlight='true')
+        self.assertEqual(
+            recipe['highlight']['text'], 'свекла и <b>капуста</b>'
+        )
+
+    def test_edit_updates_index(self):
+        self.salad.name = 'Винегрет'
+        self.salad.save()
+        self.assertEqual(self.ids('винегрет'), [self.salad.id])
+        self.assertEqual(self.ids('салат'), [])
+
+    def test_deleted_recipe_leaves_index(self):
+        self.client.force_authenticate(self.salad.author)
+        response = self.client.delete(f'/api/recipes/{self.salad.id}/')
+        self.assertEqual(response.status_code, 204)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_FTS_TABLE} WHERE rowid = %s',
+                (self.salad.id,)
+            )
+            self.assertIsNone(cursor.fetchone())
+        self.assertEqual(self.ids('свекла'), [self.borscht.id])
+
+
+class CounterTests(ApiTestCase):
+    """Счётчики меняются вместе со связями и сверяются командой."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def assert_counters_match(self):
+        call_command('reconcile_counters', check=True, stdout=StringIO())
+
+    def test_reconcile_counters(self):
+        recipe, author = self.recipes[0], self.authors[0]
+        Recipe.objects.filter(id=recipe.id).update(
+            favorites_count=5, in_carts_count=0
+        )
+        User.objects.filter(id=author.id).update(
+            recipes_count=0, followers_count=3
+        )
+        with self.assertRaises(CommandError):
+            self.assert_counters_match()
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assert_counters_match()
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_carts_count), (1, 1)
+        )
+        self.assertEqual(
+            (author.recipes_count, author.followers_count),
+            (RECIPES_PER_AUTHOR, 1),
+        )
+
+    def test_api_keeps_counters(self):
+        recipe, author = self.recipes[1], self.authors[2]
+        for action in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{recipe.id}/{action}/'
+            self.assertEqual(self.client.post(url).status_code, 201)
+            self.assert_counters_match()
+            self.assertEqual(self.client.delete(url).status_code, 204)
+            self.assert_counters_match()
+        url = f'/api/users/{author.id}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(
+            User.objects.get(id=author.id).followers_count, 1
+        )
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.client.force_authenticate(author)
+        response = self.client.delete(f'/api/recipes/{self.recipes[8].id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_counters_match()
+        self.assertEqual(
+            User.objects.get(id=author.id).recipes_count,
+            RECIPES_PER_AUTHOR - 1,
+        )
+
+    def test_counter_does_not_go_below_zero(self):
+        recipe = self.recipes[1]
+        change_counter(Recipe, recipe.id, 'favorites_count', -1)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
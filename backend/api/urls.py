@@ -1,8 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import (IngredientViewSet, RecipeViewSet, SubscriptionsApiView,
-                       TagsViewSet, UsersViewSet)
+from api.views import (ConnectionStatsView, IngredientViewSet, RecipeViewSet,
+                       SubscriptionsApiView, TagsViewSet, UsersViewSet)
+from foodgram.metrics import MetricsView
 
 app_name = 'api'
 
@@ -14,6 +15,8 @@ router.register('ingredients', IngredientViewSet)
 
 urlpatterns = [
     path('users/subscriptions/', SubscriptionsApiView.as_view()),
+    path('stats/connections/', ConnectionStatsView.as_view()),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,20 +1,320 @@
-from django.db.models import Sum, F
+import csv
+import functools
+import struct
+import zlib
 
-from recipes.models import IngredientMeasure
+from django.conf import settings
+from django.db.models import F
+
+from recipes.models import Recipe, ShoppingListItem
+from users.models import Follow
+from .constants import (PDF_FONT_NAME, PDF_FONT_SIZE, PDF_LINE_HEIGHT,
+                        PDF_LINES_PER_PAGE, PDF_MARGIN, PDF_PAGE_HEIGHT,
+                        PDF_PAGE_WIDTH, SHOPPING_LIST_CHUNK_SIZE,
+                        SHOPPING_LIST_TITLE)
+
+FOLLOWED_AUTHORS_ATTRIBUTE = '_followed_authors'
+
+
+def change_counter(model, pk, field, delta):
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def attach_limited_recipes(authors, limit=None):
+    authors = {author.id: author for author in authors}
+    for author in authors.values():
+        author.limited_recipes = []
+    if not authors:
+        return
+    for recipe in Recipe.objects.limited_per_author(authors, limit):
+        authors[recipe.author_id].limited_recipes.append(recipe)
+
+
+def format_ids(ids):
+    return ', '.join(str(pk) for pk in ids)
+
+
+def get_followed_authors(request):
+    followed = getattr(request, FOLLOWED_AUTHORS_ATTRIBUTE, None)
+    if followed is None:
+        followed = set()
+        if request.user.is_authenticated:
+            followed.update(Follow.objects.filter(
+                user=request.user
+            ).values_list('author_id', flat=True))
+        setattr(request, FOLLOWED_AUTHORS_ATTRIBUTE, followed)
+    return followed
+
+
+def reset_followed_authors(request):
+    setattr(request, FOLLOWED_AUTHORS_ATTRIBUTE, None)
 
 
 def create_cart(user):
-    ingredients = IngredientMeasure.objects.select_related(
-        'recipe', 'ingredient'
-    )
-    ingredients = ingredients.values(
-        'ingredient__name', 'ingredient__measurement_unit'
-    ).annotate(
+    return ShoppingListItem.objects.filter(user=user).values(
+        'total_amount',
         name=F('ingredient__name'),
         measure=F('ingredient__measurement_unit'),
-        total_amount=Sum('amount')).order_by('-name')
-    file_list = '\n'.join([
-        f"{field['name']} - {field['total_amount']} {field['measure']}"
-        for field in ingredients
-    ])
-    return file_list
+    ).order_by('-name').iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+
+
+def cart_lines(cart):
+    for field in cart:
+        yield f"{field['name']} - {field['total_amount']} {field['measure']}"
+
+
+def cart_to_txt(cart):
+    yield SHOPPING_LIST_TITLE + '\n'
+    for line in cart_lines(cart):
+        yield line + '\n'
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def cart_to_csv(cart):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for field in cart:
+        yield writer.writerow(
+            (field['name'], field['total_amount'], field['measure'])
+        )
+
+
+class TrueTypeFont:
+    """Шрифт TrueType для встраивания в PDF целиком.
+
+    Из файла читаются только таблица символов и ширины глифов, сам
+    файл встраивается сжатым. Текст записывается номерами глифов
+    (Identity-H), поэтому кириллица не зависит от кодировок PDF.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        tables = {}
+        for index in range(struct.unpack_from('>H', data, 4)[0]):
+            tag, _, offset, length = struct.unpack_from(
+                '>4sIII', data, 12 + index * 16
+            )
+            tables[tag.decode('latin-1')] = (offset, length)
+        head = tables['head'][0]
+        self.units = struct.unpack_from('>H', data, head + 18)[0]
+        self.bbox = [
+            self.scale(value)
+            for value in struct.unpack_from('>4h', data, head + 36)
+        ]
+        hhea = tables['hhea'][0]
+        ascent, descent = struct.unpack_from('>2h', data, hhea + 4)
+        self.ascent, self.descent = self.scale(ascent), self.scale(descent)
+        metrics = struct.unpack_from('>H', data, hhea + 34)[0]
+        self.advances = struct.unpack_from(
+            f'>{metrics * 2}H', data, tables['hmtx'][0]
+        )[::2]
+        self.glyphs = self.read_cmap(data, tables['cmap'][0])
+        self.length = len(data)
+        self.data = zlib.compress(data)
+
+    def scale(self, value):
+        return round(value * 1000 / self.units)
+
+    @staticmethod
+    def read_cmap(data, cmap):
+        """Символы Юникода из подтаблицы формата 4 (3, 1)."""
+        for index in range(struct.unpack_from('>H', data, cmap + 2)[0]):
+            platform, encoding, offset = struct.unpack_from(
+                '>HHI', data, cmap + 4 + index * 8
+            )
+            if (platform, encoding) == (3, 1):
+                break
+        else:
+            raise ValueError('В шрифте нет таблицы символов Юникода')
+        table = cmap + offset
+        segments = struct.unpack_from('>H', data, table + 6)[0] // 2
+        ends = table + 14
+        starts = ends + segments * 2 + 2
+        deltas = starts + segments * 2
+        range_offsets = deltas + segments * 2
+        glyphs = {}
+        for segment in range(segments):
+            end, start, delta, range_offset = (
+                struct.unpack_from('>H', data, array + segment * 2)[0]
+                for array in (ends, starts, deltas, range_offsets)
+            )
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if range_offset:
+                    glyph = struct.unpack_from(
+                        '>H', data,
+                        range_offsets + segment * 2 + range_offset
+                        + (code - start) * 2,
+                    )[0]
+                    if glyph:
+                        glyph = (glyph + delta) % 0x10000
+                else:
+                    glyph = (code + delta) % 0x10000
+                if glyph:
+                    glyphs[chr(code)] = glyph
+        return glyphs
+
+    def width(self, glyph):
+        return self.scale(self.advances[min(glyph, len(self.advances) - 1)])
+
+
+@functools.lru_cache(maxsize=None)
+def pdf_font(path):
+    return TrueTypeFont(path)
+
+
+def pdf_string(text, font, used):
+    glyphs = []
+    for char in text:
+        glyph = font.glyphs.get(char, 0)
+        used.setdefault(glyph, char)
+        glyphs.append(f'{glyph:04X}')
+    return f'<{"".join(glyphs)}>'.encode()
+
+
+def pdf_stream(dictionary, content):
+    return (
+        f'<< {dictionary} /Length {len(content)} >>\nstream\n'.encode()
+        + content + b'\nendstream'
+    )
+
+
+def pdf_to_unicode(used):
+    entries = ''.join(
+        f'<{glyph:04X}> <{ord(char):04X}>\n'
+        for glyph, char in sorted(used.items()) if glyph
+    )
+    return (
+        '/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+        '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+        '/Supplement 0 >> def\n/CMapName /Adobe-Identity-UCS def\n'
+        '/CMapType 2 def\n1 begincodespacerange\n<0000> <FFFF>\n'
+        f'endcodespacerange\n{len(used) - (0 in used)} beginbfchar\n'
+        f'{entries}endbfchar\nendcmap\n'
+        'CMapName currentdict /CMap defineresource pop\nend\nend'
+    ).encode()
+
+
+def pdf_font_objects(font, used, first_id):
+    """Объекты шрифта: Type0 под номером 3 и его части с first_id."""
+    cid_font, descriptor, font_file, to_unicode = range(
+        first_id, first_id + 4
+    )
+    widths = ' '.join(
+        f'{glyph} [{font.width(glyph)}]' for glyph in sorted(used)
+    )
+    return {
+        3: (
+            f'<< /Type /Font /Subtype /Type0 /BaseFont /{PDF_FONT_NAME} '
+            f'/Encoding /Identity-H /DescendantFonts [{cid_font} 0 R] '
+            f'/ToUnicode {to_unicode} 0 R >>'
+        ).encode(),
+        cid_font: (
+            f'<< /Type /Font /Subtype /CIDFontType2 '
+            f'/BaseFont /{PDF_FONT_NAME} /CIDSystemInfo << '
+            f'/Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+            f'/FontDescriptor {descriptor} 0 R /W [{widths}] '
+            f'/CIDToGIDMap /Identity >>'
+        ).encode(),
+        descriptor: (
+            f'<< /Type /FontDescriptor /FontName /{PDF_FONT_NAME} '
+            f'/Flags 32 /FontBBox [{" ".join(map(str, font.bbox))}] '
+            f'/ItalicAngle 0 /Ascent {font.ascent} '
+            f'/Descent {font.descent} /CapHeight {font.ascent} '
+            f'/StemV 80 /FontFile2 {font_file} 0 R >>'
+        ).encode(),
+        font_file: pdf_stream(
+            f'/Filter /FlateDecode /Length1 {font.length}', font.data
+        ),
+        to_unicode: pdf_stream('', pdf_to_unicode(used)),
+    }
+
+
+def pdf_page_content(lines, font, used):
+    content = [
+        b'BT',
+        f'/F1 {PDF_FONT_SIZE} Tf {PDF_LINE_HEIGHT} TL'.encode(),
+        f'{PDF_MARGIN} {PDF_PAGE_HEIGHT - PDF_MARGIN} Td'.encode(),
+    ]
+    for line in lines:
+        content.append(pdf_string(line, font, used) + b" '")
+    content.append(b'ET')
+    return b'\n'.join(content)
+
+
+def cart_to_pdf(cart):
+    # Объекты: 1 - каталог, 2 - дерево страниц, 3 - шрифт,
+    # далее по два объекта (содержимое и страница) на каждую страницу,
+    # а после страниц части шрифта: ширины известны только в конце.
+    font = pdf_font(settings.PDF_FONT_PATH)
+    used = {}
+    offsets = {}
+    position = 0
+    page_ids = []
+
+    def pdf_object(number, body):
+        nonlocal position
+        offsets[number] = position
+        chunk = f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+        position += len(chunk)
+        return chunk
+
+    def pdf_page(lines):
+        content_id = 4 + len(page_ids) * 2
+        page_id = content_id + 1
+        page_ids.append(page_id)
+        content = pdf_page_content(lines, font, used)
+        return pdf_object(
+            content_id, pdf_stream('', content)
+        ) + pdf_object(
+            page_id,
+            (
+                f'<< /Type /Page /Parent 2 0 R '
+                f'/MediaBox [0 0 {PDF_PAGE_WIDTH} {PDF_PAGE_HEIGHT}] '
+                f'/Resources << /Font << /F1 3 0 R >> >> '
+                f'/Contents {content_id} 0 R >>'
+            ).encode()
+        )
+
+    header = b'%PDF-1.4\n'
+    position += len(header)
+    yield header
+    yield pdf_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    lines = [SHOPPING_LIST_TITLE]
+    for line in cart_lines(cart):
+        lines.append(line)
+        if len(lines) == PDF_LINES_PER_PAGE:
+            yield pdf_page(lines)
+            lines = []
+    if lines or not page_ids:
+        yield pdf_page(lines)
+    for number, body in pdf_font_objects(
+        font, used, 4 + len(page_ids) * 2
+    ).items():
+        yield pdf_object(number, body)
+    kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+    yield pdf_object(2, (
+        f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'
+    ).encode())
+    size = max(offsets) + 1
+    xref = [f'xref\n0 {size}\n0000000000 65535 f \n']
+    for number in range(1, size):
+        xref.append(f'{offsets[number]:010d} 00000 n \n')
+    yield ''.join(xref).encode() + (
+        f'trailer\n<< /Size {size} /Root 1 0 R >>\n'
+        f'startxref\n{position}\n%%EOF\n'
+    ).encode()
+
+
+SHOPPING_LIST_WRITERS = {
+    'txt': cart_to_txt,
+    'csv': cart_to_csv,
+    'pdf': cart_to_pdf,
+}
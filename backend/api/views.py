@@ -1,25 +1,39 @@
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import BooleanField, Value
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from recipes.models import (Favorite, Ingredient, Recipe,
-                            ShoppingCart, Tag)
+from foodgram.db import get_connection_stats
+from recipes.models import (Favorite, FeedEntry, Ingredient, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
 from users.models import Follow
+from .cache import ingredients_cache, tags_cache
+from .constants import (INGREDIENT_SEARCH_PARAMS, KEYSET_DEFAULT_ORDERING,
+                        RECIPES_LIMIT_QUERY_PARAM)
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import LimitPaginator
+from .pagination import FeedPaginator, LimitPaginator
+from .renderers import (CSVShoppingListRenderer, PDFShoppingListRenderer,
+                        TextShoppingListRenderer)
+from .search import ingredient_index
 from .serializers import (FavoriteSerializer, FollowSerializer,
                           IngredientSerializer, RecipeListSerializer,
-                          RecipeSerializer, SubscribeSerializer, TagSerializer,
-                          UserSerializer, ShoppingCartSerializer)
-from .utils import create_cart
+                          RecipeSerializer, ShortRecipeSerializer,
+                          SubscribeSerializer, TagSerializer, UserSerializer,
+                          ShoppingCartSerializer)
+from .utils import (SHOPPING_LIST_WRITERS, attach_limited_recipes,
+                    change_counter, create_cart, reset_followed_authors)
 
 User = get_user_model()
 
@@ -36,6 +50,7 @@ class UsersViewSet(UserViewSet):
         serializer_class=SubscribeSerializer,
         permission_classes=[IsAuthenticated]
     )
+    @transaction.atomic
     def subscribe(self, request, id):
         user = self.request.user
         author = get_object_or_404(User, pk=id)
@@ -48,12 +63,18 @@ class UsersViewSet(UserViewSet):
             serializer = self.get_serializer(data=data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            change_counter(User, author.id, 'followers_count', 1)
+            FeedEntry.objects.backfill(user.id, author)
+            reset_followed_authors(request)
             return Response(
                 serializer.data,
                 status=status.HTTP_201_CREATED
             )
         subscription = get_object_or_404(Follow, user=user, author=author)
         subscription.delete()
+        change_counter(User, author.id, 'followers_count', -1)
+        FeedEntry.objects.remove_author(user.id, author)
+        reset_followed_authors(request)
         return HttpResponse(
             'Успешная отписка',
             status=status.HTTP_204_NO_CONTENT
@@ -64,40 +85,90 @@ class SubscriptionsApiView(generics.ListAPIView):
     permission_classes = [IsAuthenticated, ]
     pagination_class = LimitPaginator
     serializer_class = FollowSerializer
+    keyset_ordering = ('id',)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({'request': self.request})
         return context
 
+    def get_recipes_limit(self):
+        limit = self.request.query_params.get(RECIPES_LIMIT_QUERY_PARAM)
+        if not limit:
+            return None
+        try:
+            limit = int(limit)
+            if limit < 0:
+                raise ValueError
+        except ValueError:
+            raise ValidationError({
+                RECIPES_LIMIT_QUERY_PARAM: (
+                    'Значение должно быть неотрицательным целым числом'
+                )
+            })
+        return limit
+
+    def list(self, request, *args, **kwargs):
+        self.recipes_limit = self.get_recipes_limit()
+        return super().list(request, *args, **kwargs)
+
     def get_queryset(self):
-        return User.objects.filter(following__user=self.request.user)
+        return User.objects.filter(
+            following__user=self.request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('id')
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        attach_limited_recipes(page, self.recipes_limit)
+        return page
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.order_by(*KEYSET_DEFAULT_ORDERING)
     serializer_class = RecipeSerializer
     pagination_class = LimitPaginator
     permission_classes = (AllowAny,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve', 'feed'):
+            return queryset.with_related().with_user_flags(
+                self.request.user
+            )
+        return queryset
+
     def get_serializer_class(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'feed'):
             return RecipeListSerializer
         return RecipeSerializer
 
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        change_counter(User, self.request.user.id, 'recipes_count', 1)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingListItem.objects.remove_recipe(
+            instance.id,
+            list(instance.shopping_cart.values_list('user_id', flat=True))
+        )
+        instance.delete()
+        change_counter(User, instance.author_id, 'recipes_count', -1)
 
-    def del_obj(self, model, user, pk):
+    def del_obj(self, model, user, pk, counter):
         obj = get_object_or_404(model, user=user, recipe__id=pk)
         obj.delete()
+        change_counter(Recipe, pk, counter, -1)
         return Response(
             status=status.HTTP_204_NO_CONTENT
         )
 
-    def add_obj(self, serializer_choice, user, pk):
+    def add_obj(self, serializer_choice, user, pk, counter):
         data = {
             'user': user.id,
             'recipe': pk,
@@ -105,6 +176,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         serializer = serializer_choice(data=data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        change_counter(Recipe, pk, counter, 1)
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
@@ -116,10 +188,13 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated],
         pagination_class=None
     )
+    @transaction.atomic
     def favorite(self, request, pk=None):
         if request.method == 'POST':
-            return self.add_obj(FavoriteSerializer, request.user, pk)
-        return self.del_obj(Favorite, request.user, pk)
+            return self.add_obj(
+                FavoriteSerializer, request.user, pk, 'favorites_count'
+            )
+        return self.del_obj(Favorite, request.user, pk, 'favorites_count')
 
     @action(
         detail=True,
@@ -127,36 +202,95 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated],
         pagination_class=None
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk=None):
         if request.method == 'POST':
-            return self.add_obj(ShoppingCartSerializer, request.user, pk)
-        return self.del_obj(ShoppingCart, request.user, pk)
+            response = self.add_obj(
+                ShoppingCartSerializer, request.user, pk, 'in_carts_count'
+            )
+            ShoppingListItem.objects.add_recipe(pk, [request.user.id])
+            return response
+        response = self.del_obj(
+            ShoppingCart, request.user, pk, 'in_carts_count'
+        )
+        ShoppingListItem.objects.remove_recipe(pk, [request.user.id])
+        return response
+
+    @action(
+        detail=True,
+        methods=['GET'],
+        pagination_class=None
+    )
+    def similar(self, request, pk=None):
+        recipes = list(Recipe.objects.filter(
+            similar_to__recipe_id=pk
+        ).order_by('-similar_to__score'))
+        if not recipes:
+            get_object_or_404(Recipe, pk=pk)
+        serializer = ShortRecipeSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
 
     @action(
         detail=False,
         methods=['GET'],
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPaginator
+    )
+    def feed(self, request):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(TextShoppingListRenderer,
+                          CSVShoppingListRenderer,
+                          PDFShoppingListRenderer)
     )
     def download_shopping_cart(self, request, **kwargs):
         user = request.user
-        filename = f'{user.username}_shopping_list.txt'
-        cart = create_cart(user)
-        file = HttpResponse(
-            'Cписок покупок:\n' + cart,
-            content_type='text/plain'
+        renderer = request.accepted_renderer
+        filename = f'{user.username}_shopping_list.{renderer.format}'
+        # Строк в списке не больше, чем ингредиентов, поэтому они
+        # читаются здесь: при отдаче потока запрос уже шёл бы вне
+        # выбора реплики и замеров RequestMetricsMiddleware.
+        cart = list(create_cart(user))
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        file = StreamingHttpResponse(
+            SHOPPING_LIST_WRITERS[renderer.format](cart),
+            content_type=content_type
         )
         file['Content-Disposition'] = (f'attachment; filename={filename}')
         return file
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class ReferenceCacheMixin:
+    reference_cache = None
+
+    def render_list(self):
+        return JSONRenderer().render(
+            self.get_serializer(self.get_queryset(), many=True).data
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.reference_cache.response(request, self.render_list)
+
+
+class TagsViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    reference_cache = tags_cache
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
     queryset = Ingredient.objects.all()
@@ -164,3 +298,27 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (SearchFilter, DjangoFilterBackend)
     search_fields = ('^name',)
     filterset_class = IngredientFilter
+    reference_cache = ingredients_cache
+
+    def list(self, request, *args, **kwargs):
+        query = next(
+            (
+                request.query_params[param]
+                for param in INGREDIENT_SEARCH_PARAMS
+                if param in request.query_params
+            ),
+            ''
+        )
+        if not query:
+            return super().list(request, *args, **kwargs)
+        return HttpResponse(
+            ingredient_index.search(query),
+            content_type='application/json'
+        )
+
+
+class ConnectionStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(get_connection_stats())
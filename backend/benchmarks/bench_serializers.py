@@ -0,0 +1,100 @@
+import tracemalloc
+
+import pytest
+from django.db import connection
+from django.db.models import BooleanField, Value
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import (FollowSerializer, RecipeListSerializer,
+                             ShowRecipeSerializer, UserSerializer)
+from api.utils import attach_limited_recipes, create_cart
+from recipes.models import Recipe
+from users.models import User
+
+RECIPES_LIMIT = 3
+
+pytestmark = pytest.mark.django_db
+
+
+def context(viewer):
+    request = Request(APIRequestFactory().get('/'))
+    request.user = viewer
+    return {'request': request}
+
+
+def recipes(viewer, size):
+    return Recipe.objects.with_related().with_user_flags(
+        viewer
+    ).order_by('-pub_date', '-id')[:size]
+
+
+def recipe_list(viewer, size):
+    return RecipeListSerializer(
+        recipes(viewer, size), many=True, context=context(viewer)
+    ).data
+
+
+def show_recipe(viewer, size):
+    return ShowRecipeSerializer(
+        recipes(viewer, size), many=True, context=context(viewer)
+    ).data
+
+
+def follow(viewer, size):
+    authors = list(User.objects.filter(
+        following__user=viewer
+    ).annotate(
+        is_subscribed=Value(True, output_field=BooleanField())
+    ).order_by('id')[:size])
+    attach_limited_recipes(authors, RECIPES_LIMIT)
+    return FollowSerializer(
+        authors, many=True, context=context(viewer)
+    ).data
+
+
+def user(viewer, size):
+    return UserSerializer(
+        User.objects.order_by('id')[:size], many=True,
+        context=context(viewer),
+    ).data
+
+
+def cart(viewer, size):
+    return [row for row, _ in zip(create_cart(viewer), range(size))]
+
+
+CASES = {
+    'RecipeListSerializer': recipe_list,
+    'ShowRecipeSerializer': show_recipe,
+    'FollowSerializer': follow,
+    'UserSerializer': user,
+    'create_cart': cart,
+}
+
+
+@pytest.mark.parametrize('name', CASES)
+def bench_serializer(benchmark, budget, viewer, name, size):
+    """Время, пик памяти и число SQL-запросов в пределах бюджета.
+
+    Время — лучший из прогонов pytest-benchmark, память и запросы
+    снимаются отдельным прогоном, чтобы tracemalloc не искажал время.
+    """
+    case = CASES[name]
+    benchmark(case, viewer, size)
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        case(viewer, size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        'queries': len(queries),
+        'time_ms': (
+            None if benchmark.disabled
+            else round(benchmark.stats.stats.min * 1000, 2)
+        ),
+        'peak_kb': round(peak / 1024, 1),
+    }
+    benchmark.extra_info.update(result)
+    budget.check(name, size, result)
@@ -0,0 +1,186 @@
+import json
+import os
+from io import StringIO
+from pathlib import Path
+
+import pytest
+from django.core.management import call_command
+
+BUDGET = Path(__file__).with_name('budgets.json')
+DEFAULT_SIZES = '10,100,1000,10000'
+BATCH_SIZE = 1000
+INGREDIENTS_PER_RECIPE = 5
+TIME_HEADROOM = 1.5
+TIME_SLACK_MS = 5
+MEMORY_HEADROOM = 1.2
+# Время зависит от машины и её загрузки, поэтому по умолчанию
+# проверяются только запросы и память, а бюджет времени включается
+# переменной окружения на той же машине, где он записан.
+CHECK_TIME = os.getenv('BENCHMARK_CHECK_TIME', '').lower() == 'true'
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--sizes', default=DEFAULT_SIZES,
+        help='Размеры выборок через запятую',
+    )
+    parser.addoption(
+        '--update-budget',
+        action='store_true',
+        help='Записать текущие замеры в бюджет с запасом по времени '
+             'и памяти',
+    )
+
+
+def sizes(config):
+    return sorted(int(size) for size in config.getoption('sizes').split(','))
+
+
+def pytest_generate_tests(metafunc):
+    if 'size' in metafunc.fixturenames:
+        metafunc.parametrize('size', sizes(metafunc.config))
+
+
+class Budget:
+    """Бюджет запросов, времени и памяти из budgets.json."""
+
+    def __init__(self, path, update):
+        self.path = path
+        self.update = update
+        with open(path, encoding='utf-8') as file:
+            self.limits = json.load(file)
+
+    def check(self, name, size, result):
+        if self.update:
+            self.limits.setdefault(name, {})[str(size)] = {
+                'queries': result['queries'],
+                'time_ms': round(
+                    result['time_ms'] * TIME_HEADROOM + TIME_SLACK_MS, 1
+                ),
+                'peak_kb': round(result['peak_kb'] * MEMORY_HEADROOM),
+            }
+            return
+        limits = self.limits.get(name, {}).get(str(size))
+        if limits is None:
+            pytest.fail(f'Нет бюджета для {name} [{size}]')
+        failures = [
+            f'{metric} {result[metric]} > {limit}'
+            for metric, limit in limits.items()
+            if (metric != 'time_ms' or CHECK_TIME)
+            and result[metric] is not None and result[metric] > limit
+        ]
+        assert not failures, (
+            f'Превышен бюджет {name} [{size}]: ' + ', '.join(failures)
+        )
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump(self.limits, file, indent=2)
+            file.write('\n')
+
+
+@pytest.fixture(scope='session')
+def budget(request):
+    budget = Budget(BUDGET, request.config.getoption('update_budget'))
+    yield budget
+    if budget.update:
+        budget.save()
+
+
+@pytest.fixture(scope='session')
+def viewer(request, django_db_setup, django_db_blocker):
+    """Данные на самый большой размер, общие для всех замеров."""
+    with django_db_blocker.unblock():
+        return create_fixtures(sizes(request.config)[-1])
+
+
+def create_fixtures(size):
+    # Модели импортируются после настройки Django плагином pytest-django.
+    from recipes.models import (Favorite, Ingredient, IngredientMeasure,
+                                Recipe, ShoppingCart, ShoppingListItem, Tag)
+    from users.models import Follow, User
+
+    viewer = User.objects.create(
+        email='viewer@example.com', username='viewer',
+        first_name='Зритель', last_name='Тест',
+    )
+    User.objects.bulk_create(
+        (
+            User(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Автор', last_name=str(i),
+            )
+            for i in range(size)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    author_ids = list(
+        User.objects.exclude(id=viewer.id).values_list('id', flat=True)
+    )
+    Ingredient.objects.bulk_create(
+        (
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(max(size, INGREDIENTS_PER_RECIPE))
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+    Tag.objects.bulk_create(
+        Tag(name=f'тег {i}', slug=f'tag-{i}', color=f'#0000{i:02X}')
+        for i in range(3)
+    )
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author_id=author_ids[i % len(author_ids)],
+                name=f'рецепт {i}', text='описание', cooking_time=10,
+                image='recipes/benchmark.png',
+            )
+            for i in range(size)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+    IngredientMeasure.objects.bulk_create(
+        (
+            IngredientMeasure(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_ids[
+                    (index + offset) % len(ingredient_ids)
+                ],
+                amount=offset + 1,
+            )
+            for index, recipe_id in enumerate(recipe_ids)
+            for offset in range(INGREDIENTS_PER_RECIPE)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    Recipe.tags.through.objects.bulk_create(
+        (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in tag_ids[:2]
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    for model, field, ids in (
+        (Follow, 'author_id', author_ids),
+        (Favorite, 'recipe_id', recipe_ids[::2]),
+        (ShoppingCart, 'recipe_id', recipe_ids[::3]),
+    ):
+        model.objects.bulk_create(
+            (model(user=viewer, **{field: pk}) for pk in ids),
+            batch_size=BATCH_SIZE,
+        )
+    ShoppingListItem.objects.bulk_create(
+        (
+            ShoppingListItem(
+                user=viewer, ingredient_id=ingredient_id, total_amount=1
+            )
+            for ingredient_id in ingredient_ids[:size]
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    call_command('reconcile_counters', stdout=StringIO())
+    return viewer
@@ -0,0 +1,72 @@
+import os
+
+import django
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.handlers import asgi
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Соединение с базой принадлежит потоку запроса, который завершается
+# вместе с запросом, поэтому держать соединения между запросами под
+# ASGI нельзя. Через пулер (DB_CONNECTION_MODE=pooler) открытие
+# соединения дешёвое.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """ASGI-обработчик Django 3.2 с параллельной обработкой запросов.
+
+    Django 3.2 выполняет весь синхронный код (ORM, DRF, синхронные
+    middleware) в одном общем потоке процесса, и запросы идут строго
+    по очереди. Как в Django 4.0, каждый запрос получает свой поток.
+    Потоковые ответы (выгрузка списка покупок) читаются в этом же
+    потоке, а не в цикле событий, где ORM запрещён.
+    """
+
+    async def __call__(self, scope, receive, send):
+        async with ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [
+            (
+                header.encode('ascii') if isinstance(header, str) else header,
+                value.encode('latin1') if isinstance(value, str) else value,
+            )
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        )
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+        parts = iter(response)
+        read = sync_to_async(self.read_chunk, thread_sensitive=True)
+        while True:
+            chunk = await read(parts)
+            if not chunk:
+                break
+            await send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': True,
+            })
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    def read_chunk(self, parts):
+        chunk = bytearray()
+        for part in parts:
+            chunk += part
+            if len(chunk) >= self.chunk_size:
+                break
+        return bytes(chunk)
+
+
+django.setup(set_prefix=False)
+application = ASGIHandler()
@@ -0,0 +1,164 @@
+import functools
+import itertools
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+import django
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .metrics import db_connection_events
+
+use_replica = ContextVar('use_replica', default=False)
+wrote_to_primary = ContextVar('wrote_to_primary', default=False)
+
+
+class ReplicaPool:
+    """Реплики из настроек с периодической проверкой доступности.
+
+    Упавшая реплика исключается из ротации до следующей успешной
+    проверки, а при отсутствии живых реплик чтение уходит на основную
+    базу.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = {}
+        self.healthy = {}
+        self.counter = itertools.count()
+
+    @property
+    def aliases(self):
+        return [
+            alias for alias in settings.DATABASES
+            if alias.startswith(settings.DB_REPLICA_ALIAS_PREFIX)
+        ]
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            fresh = (
+                now - self.checked_at.get(alias, float('-inf'))
+                < settings.DB_REPLICA_HEALTH_CHECK_INTERVAL
+            )
+            if fresh:
+                return self.healthy.get(alias, True)
+            self.checked_at[alias] = now
+        healthy = self.check(alias)
+        self.healthy[alias] = healthy
+        return healthy
+
+    @staticmethod
+    def check(alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            connection.close()
+            return False
+        return True
+
+    def choose(self):
+        aliases = [alias for alias in self.aliases if self.is_healthy(alias)]
+        if not aliases:
+            return DEFAULT_DB_ALIAS
+        return aliases[next(self.counter) % len(aliases)]
+
+
+replicas = ReplicaPool()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if use_replica.get():
+            return replicas.choose()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        wrote_to_primary.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+connection_stats = Counter()
+
+
+def count_opened_connection(sender, connection, **kwargs):
+    connection_stats['opened'] += 1
+    connection_stats[f'opened:{connection.alias}'] += 1
+    db_connection_events.labels('opened', connection.alias).inc()
+
+
+def check_reused_connections(**kwargs):
+    """Помечает соединения, пережившие прошлый запрос, для проверки.
+
+    Повторяет CONN_HEALTH_CHECKS из Django 4.1: живость проверяется
+    не в начале каждого запроса, а при первом обращении к соединению,
+    поэтому запросы без SQL обходятся без лишнего SELECT 1.
+    Соединение, которое закрыл сервер или пулер, закрывается до того,
+    как запрос на нём упадёт, и тут же открывается заново.
+    """
+    connection_stats['requests'] += 1
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        connection_stats['reused'] += 1
+        db_connection_events.labels('reused', connection.alias).inc()
+        if (
+            connection.settings_dict.get('CONN_HEALTH_CHECKS')
+            and django.VERSION < (4, 1)
+        ):
+            defer_health_check(connection)
+
+
+def defer_health_check(connection):
+    """Откладывает проверку до первого курсора или транзакции.
+
+    Как в Django 4.1, проверка встроена в _cursor и set_autocommit, а
+    не в ensure_connection: её вызывает и close_old_connections.
+    """
+    if not hasattr(connection, 'health_check_done'):
+        for name in ('_cursor', 'set_autocommit'):
+            setattr(connection, name, with_health_check(
+                connection, getattr(connection, name)
+            ))
+    connection.health_check_done = False
+
+
+def with_health_check(connection, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        close_if_health_check_failed(connection)
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+def close_if_health_check_failed(connection):
+    if connection.health_check_done:
+        return
+    connection.health_check_done = True
+    if (
+        connection.connection is None
+        or connection.in_atomic_block
+        or connection.is_usable()
+    ):
+        return
+    connection_stats['health_check_failed'] += 1
+    db_connection_events.labels(
+        'health_check_failed', connection.alias
+    ).inc()
+    connection.close()
+
+
+def get_connection_stats():
+    return {'pid': os.getpid(), **connection_stats}
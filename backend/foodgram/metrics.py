@@ -0,0 +1,229 @@
+import hmac
+import os
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.http import HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from rest_framework.authentication import (SessionAuthentication,
+                                           TokenAuthentication)
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.permissions import BasePermission
+from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+METRICS_TOKEN_KEYWORD = 'Bearer'
+
+request_metrics = ContextVar('request_metrics', default=None)
+
+request_duration = Histogram(
+    'foodgram_request_duration_seconds',
+    'Время обработки запроса',
+    ('view', 'method', 'status'),
+    buckets=DURATION_BUCKETS,
+)
+request_db_duration = Histogram(
+    'foodgram_request_db_duration_seconds',
+    'Время SQL-запросов за запрос',
+    ('view',),
+    buckets=DURATION_BUCKETS,
+)
+request_serialization_duration = Histogram(
+    'foodgram_request_serialization_duration_seconds',
+    'Время сериализации и рендеринга ответа',
+    ('view',),
+    buckets=DURATION_BUCKETS,
+)
+request_queries = Histogram(
+    'foodgram_request_queries',
+    'Число SQL-запросов за запрос',
+    ('view',),
+    buckets=QUERY_BUCKETS,
+)
+request_duplicate_queries = Histogram(
+    'foodgram_request_duplicate_queries',
+    'Число повторов одинаковых SQL-запросов за запрос',
+    ('view',),
+    buckets=QUERY_BUCKETS,
+)
+db_connection_events = Counter(
+    'foodgram_db_connection_events',
+    'Открытые, переиспользованные и отброшенные соединения с базой',
+    ('event', 'alias'),
+)
+
+
+class RequestMetrics:
+    __slots__ = (
+        'db_time', 'queries', 'seen', 'duplicates', 'serialization',
+        'serializing',
+    )
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.queries = 0
+        self.seen = set()
+        self.duplicates = 0
+        self.serialization = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many:
+            key = (sql, repr(params))
+            if key in self.seen:
+                self.duplicates += 1
+            else:
+                self.seen.add(key)
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = request_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """Подключает record_query к соединению при его открытии.
+
+    Обёртка стоит постоянно, а не на время запроса: под ASGI
+    соединение создаётся в потоке запроса, куда middleware не
+    заглядывает.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def view_name(request):
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+def observe(request, response, metrics, total):
+    view = view_name(request)
+    request_duration.labels(
+        view, request.method, str(response.status_code)
+    ).observe(total)
+    request_db_duration.labels(view).observe(metrics.db_time)
+    request_serialization_duration.labels(view).observe(
+        metrics.serialization
+    )
+    request_queries.labels(view).observe(metrics.queries)
+    request_duplicate_queries.labels(view).observe(metrics.duplicates)
+
+
+def server_timing(metrics, total):
+    return (
+        f'total;dur={total * 1000:.1f}, '
+        f'db;dur={metrics.db_time * 1000:.1f};'
+        f'desc="{metrics.queries} queries, '
+        f'{metrics.duplicates} duplicates", '
+        f'serialize;dur={metrics.serialization * 1000:.1f}'
+    )
+
+
+def instrument_serializers():
+    """Учитывает время serializer.data в метриках текущего запроса.
+
+    Вложенные вызовы data, например сериализатор внутри
+    to_representation другого, отдельно не считаются.
+    """
+    data = BaseSerializer.data
+    if getattr(data.fget, 'instrumented', False):
+        return
+
+    def timed_data(serializer):
+        metrics = request_metrics.get()
+        if metrics is None or metrics.serializing:
+            return data.fget(serializer)
+        metrics.serializing = True
+        started = perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            metrics.serialization += perf_counter() - started
+            metrics.serializing = False
+
+    timed_data.instrumented = True
+    BaseSerializer.data = property(timed_data)
+
+
+class StaffTokenAuthentication(TokenAuthentication):
+    """Токен API сотрудника; заголовок Bearer оставлен METRICS_TOKEN."""
+
+    def authenticate(self, request):
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if authorization.split(' ', 1)[0] == METRICS_TOKEN_KEYWORD:
+            return None
+        return super().authenticate(request)
+
+
+class HasMetricsAccess(BasePermission):
+    """Токен METRICS_TOKEN в заголовке Bearer или сотрудник.
+
+    Без заданного токена метрики видны только сотрудникам.
+    """
+
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        expected = f'{METRICS_TOKEN_KEYWORD} {token}'
+        return bool(
+            token and hmac.compare_digest(
+                authorization.encode(), expected.encode()
+            )
+            or request.user.is_staff
+        )
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """Ответ всегда в формате Prometheus, какой бы Accept ни прислали."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class MetricsView(APIView):
+    """Метрики Prometheus.
+
+    Сотрудник входит по токену API или через сессию админки,
+    сборщик метрик — по METRICS_TOKEN.
+    """
+
+    authentication_classes = (
+        StaffTokenAuthentication, SessionAuthentication
+    )
+    permission_classes = (HasMetricsAccess,)
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request):
+        registry = REGISTRY
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return HttpResponse(
+            generate_latest(registry), content_type=CONTENT_TYPE_LATEST
+        )
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+
+from .db import replicas, use_replica, wrote_to_primary
+from .metrics import RequestMetrics, observe, request_metrics, server_timing
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+class SyncAndAsyncMiddleware:
+    """Middleware для WSGI и ASGI без лишних переходов между потоками.
+
+    Под ASGI синхронное middleware Django выполняет в потоке запроса и
+    на каждое такое звено тратит по переходу из цикла событий.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Так Django распознаёт асинхронный экземпляр, как у
+            # MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.acall(request)
+        return self.call(request)
+
+
+class ReplicaRoutingMiddleware(SyncAndAsyncMiddleware):
+    """Отправляет чтение безопасных запросов на реплики.
+
+    После записи клиент на DB_REPLICA_PIN_SECONDS закрепляется за
+    основной базой: через cookie, а для клиентов с токеном ещё и через
+    общий кэш, чтобы сразу видеть свои изменения. Закрепление в кэше
+    своего процесса другой воркер не увидит, поэтому с репликами нужен
+    общий кэш (CACHE_LOCATION).
+    """
+
+    def __init__(self, get_response):
+        if not replicas.aliases:
+            raise MiddlewareNotUsed
+        if isinstance(caches[DEFAULT_CACHE_ALIAS], PROCESS_LOCAL_CACHES):
+            raise ImproperlyConfigured(
+                'Для реплик нужен общий для всех воркеров кэш: задайте '
+                'CACHE_LOCATION или CACHE_BACKEND'
+            )
+        super().__init__(get_response)
+
+    def call(self, request):
+        key = self.pin_key(request)
+        replica_token = use_replica.set(
+            request.method in SAFE_METHODS
+            and not self.is_pinned(request, key)
+        )
+        wrote_token = wrote_to_primary.set(False)
+        try:
+            response = self.get_response(request)
+            if self.should_pin(request):
+                self.pin(response, key)
+        finally:
+            use_replica.reset(replica_token)
+            wrote_to_primary.reset(wrote_token)
+        return response
+
+    async def acall(self, request):
+        key = self.pin_key(request)
+        replica_token = use_replica.set(
+            request.method in SAFE_METHODS
+            and not await sync_to_async(self.is_pinned)(request, key)
+        )
+        wrote_token = wrote_to_primary.set(False)
+        try:
+            response = await self.get_response(request)
+            if self.should_pin(request):
+                await sync_to_async(self.pin)(response, key)
+        finally:
+            use_replica.reset(replica_token)
+            wrote_to_primary.reset(wrote_token)
+        return response
+
+    @staticmethod
+    def should_pin(request):
+        return wrote_to_primary.get() or request.method not in SAFE_METHODS
+
+    @staticmethod
+    def pin_key(request):
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        if not authorization:
+            return None
+        digest = hashlib.sha1(authorization.encode()).hexdigest()
+        return f'{settings.DB_REPLICA_PIN_COOKIE}:{digest}'
+
+    @staticmethod
+    def is_pinned(request, key):
+        try:
+            pinned_until = float(
+                request.COOKIES.get(settings.DB_REPLICA_PIN_COOKIE, 0)
+            )
+        except ValueError:
+            pinned_until = 0
+        if pinned_until > time.time():
+            return True
+        return key is not None and cache.get(key) is not None
+
+    @staticmethod
+    def pin(response, key):
+        seconds = settings.DB_REPLICA_PIN_SECONDS
+        response.set_cookie(
+            settings.DB_REPLICA_PIN_COOKIE,
+            str(time.time() + seconds),
+            max_age=seconds,
+            httponly=True,
+            samesite='Lax',
+        )
+        if key is not None:
+            cache.set(key, True, timeout=seconds)
+
+
+class RequestMetricsMiddleware(SyncAndAsyncMiddleware):
+    """Замеряет запрос: общее время, SQL, повторы запросов и сериализацию.
+
+    Итог уходит в заголовок Server-Timing и в гистограммы
+    Prometheus по имени представления и действия. SQL считает
+    record_query на каждом соединении.
+    """
+
+    def call(self, request):
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def acall(self, request):
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    @staticmethod
+    def finish(request, response, metrics, started):
+        total = time.perf_counter() - started
+        observe(request, response, metrics, total)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(metrics, total)
+        return response
+
+    def process_template_response(self, request, response):
+        metrics = request_metrics.get()
+        started = time.perf_counter()
+
+        def rendered(response):
+            metrics.serialization += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
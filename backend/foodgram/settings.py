@@ -31,7 +31,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -71,6 +73,85 @@ DATABASES = {
     }
 }
 
+DB_CONNECTION_MODE = os.getenv('DB_CONNECTION_MODE', default='persistent')
+if DB_CONNECTION_MODE in ('persistent', 'pooler'):
+    DATABASES['default'].update(
+        CONN_MAX_AGE=int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        CONN_HEALTH_CHECKS=os.getenv(
+            'DB_CONN_HEALTH_CHECKS', 'True'
+        ).lower() == 'true',
+        DISABLE_SERVER_SIDE_CURSORS=DB_CONNECTION_MODE == 'pooler',
+    )
+
+DB_REPLICA_ALIAS_PREFIX = 'replica_'
+DB_REPLICA_PIN_COOKIE = 'primary_pin'
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', default=5))
+DB_REPLICA_HEALTH_CHECK_INTERVAL = int(
+    os.getenv('DB_REPLICA_HEALTH_CHECK_INTERVAL', default=30)
+)
+
+for index, replica_host in enumerate(
+    filter(None, os.getenv('DB_REPLICA_HOSTS', default='').split(',')),
+    start=1,
+):
+    replica_host, _, replica_port = replica_host.strip().partition(':')
+    DATABASES[f'{DB_REPLICA_ALIAS_PREFIX}{index}'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv(
+            'DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']
+        ),
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['foodgram.db.ReplicaRouter']
+
+# Поколения справочников, индекс ингредиентов и закрепление за основной
+# базой должны быть общими для всех воркеров, поэтому с заданным
+# CACHE_LOCATION по умолчанию используется memcached. LocMemCache у
+# каждого процесса свой и годится только для разработки и тестов.
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', default='')
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default=(
+                'django.core.cache.backends.memcached.PyMemcacheCache'
+                if CACHE_LOCATION
+                else 'django.core.cache.backends.locmem.LocMemCache'
+            )
+        ),
+        'LOCATION': CACHE_LOCATION,
+    }
+}
+
+METRICS_SERVER_TIMING = (
+    os.getenv('METRICS_SERVER_TIMING', 'True').lower() == 'true'
+)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+
+# Журнал медленных запросов включается заданием каталога.
+SLOW_QUERY_DIR = os.getenv('SLOW_QUERY_DIR', default='')
+SLOW_QUERY_THRESHOLD_MS = float(
+    os.getenv('SLOW_QUERY_THRESHOLD_MS', default=100)
+)
+SLOW_QUERY_EXPLAIN_SAMPLE = float(
+    os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE', default=0.1)
+)
+SLOW_QUERY_LOG_MAX_BYTES = int(
+    os.getenv('SLOW_QUERY_LOG_MAX_BYTES', default=10 * 1024 * 1024)
+)
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv('SLOW_QUERY_LOG_BACKUPS', default=5))
+
+# Шрифт с кириллицей, который встраивается в PDF со списком покупок.
+PDF_FONT_PATH = os.getenv(
+    'PDF_FONT_PATH',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
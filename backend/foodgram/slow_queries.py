@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from time import perf_counter
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+CALL_SITE_APPS = ('api', 'recipes', 'users')
+LOG_FILE_PREFIX = 'slow_queries'
+
+NORMALIZE_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def normalize_sql(sql):
+    for pattern, replacement in NORMALIZE_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def call_site():
+    """Ближайший к запросу кадр из кода проекта, а не Django или DRF."""
+    roots = tuple(
+        os.path.join(settings.BASE_DIR, app) + os.sep
+        for app in CALL_SITE_APPS
+    )
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(roots):
+            return (
+                f'{os.path.relpath(filename, settings.BASE_DIR)}:'
+                f'{frame.f_lineno} in {frame.f_code.co_name}'
+            )
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryLogger:
+    """Пишет запросы дольше SLOW_QUERY_THRESHOLD_MS в NDJSON.
+
+    У каждого процесса свой файл с ротацией, чтобы воркеры gunicorn
+    не мешали друг другу. На PostgreSQL для доли
+    SLOW_QUERY_EXPLAIN_SAMPLE медленных SELECT повторяется
+    EXPLAIN (ANALYZE, BUFFERS) с теми же параметрами.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.logger = None
+        self.pid = None
+
+    def install(self, sender, connection, **kwargs):
+        # В начало списка: execute_wrapper() снимает последнюю обёртку
+        # по выходу из блока и не должен снять эту.
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, self)
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(self.local, 'explaining', False):
+            return execute(sql, params, many, context)
+        started = perf_counter()
+        result = execute(sql, params, many, context)
+        duration = perf_counter() - started
+        if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+            self.record(sql, params, many, context['connection'], duration)
+        return result
+
+    def record(self, sql, params, many, connection, duration):
+        normalized = normalize_sql(sql)
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'pid': os.getpid(),
+            'alias': connection.alias,
+            'duration_ms': round(duration * 1000, 2),
+            'fingerprint': fingerprint(normalized),
+            'sql': normalized,
+            'many': many,
+            'call_site': call_site(),
+        }
+        if (
+            connection.vendor == 'postgresql'
+            and not many
+            and sql.lstrip()[:6].upper() == 'SELECT'
+            and random.random() < settings.SLOW_QUERY_EXPLAIN_SAMPLE
+        ):
+            entry['plan'] = self.explain(connection, sql, params)
+        self.get_logger().info(json.dumps(entry, ensure_ascii=False))
+
+    def explain(self, connection, sql, params):
+        self.local.explaining = True
+        try:
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params
+                    )
+                    return '\n'.join(row[0] for row in cursor.fetchall())
+        except DatabaseError as error:
+            return f'EXPLAIN не удался: {error}'
+        finally:
+            self.local.explaining = False
+
+    def get_logger(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                os.makedirs(settings.SLOW_QUERY_DIR, exist_ok=True)
+                self.pid = os.getpid()
+                handler = RotatingFileHandler(
+                    os.path.join(
+                        settings.SLOW_QUERY_DIR,
+                        f'{LOG_FILE_PREFIX}-{self.pid}.ndjson',
+                    ),
+                    maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+                    backupCount=settings.SLOW_QUERY_LOG_BACKUPS,
+                    encoding='utf-8',
+                )
+                self.logger = logging.getLogger(
+                    f'{__name__}.{self.pid}'
+                )
+                self.logger.propagate = False
+                self.logger.setLevel(logging.INFO)
+                self.logger.handlers = [handler]
+            return self.logger
+
+
+slow_query_logger = SlowQueryLogger()
@@ -0,0 +1,371 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import connection, connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.cache import tags_cache
+from api.utils import change_counter
+from recipes.models import Recipe
+from users.models import Follow, User
+
+from .asgi import application
+from .db import connection_stats
+from .slow_queries import (LOG_FILE_PREFIX, fingerprint, normalize_sql,
+                           slow_query_logger)
+
+REPLICA = f'{settings.DB_REPLICA_ALIAS_PREFIX}1'
+ASGI_TIMEOUT = 5
+
+
+class ReplicaTestCase(TransactionTestCase):
+    """Основная база и реплика — две SQLite-базы в памяти.
+
+    Реплика получает копию основной базы в setUp и дальше не
+    обновляется, то есть отстаёт от неё на все последующие записи.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Реплика подключается после проверок TransactionTestCase,
+        # которые запрещают запросы к базам вне databases.
+        settings.DATABASES[REPLICA] = {
+            **connections['default'].settings_dict,
+            'NAME': f'file:memorydb_{REPLICA}?mode=memory&cache=shared',
+        }
+        cls.cache_dir = tempfile.mkdtemp()
+        cls.cache_override = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': cls.cache_dir,
+        }})
+        cls.cache_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache_override.disable()
+        shutil.rmtree(cls.cache_dir)
+        connections[REPLICA].connection.close()
+        del connections[REPLICA]
+        del settings.DATABASES[REPLICA]
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create(
+            email='viewer@example.com', username='viewer',
+            first_name='Зритель', last_name='Тест',
+        )
+        self.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тест',
+        )
+        self.token = Token.objects.create(user=self.viewer)
+        for alias in ('default', REPLICA):
+            connections[alias].ensure_connection()
+        connections['default'].connection.backup(
+            connections[REPLICA].connection
+        )
+        self.client = self.token_client()
+
+    def token_client(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return client
+
+    def subscriptions(self, client):
+        response = client.get('/api/users/subscriptions/')
+        self.assertEqual(response.status_code, 200)
+        return [author['id'] for author in response.data['results']]
+
+
+class ReplicaRoutingTests(ReplicaTestCase):
+
+    def test_safe_requests_read_from_replica(self):
+        Follow.objects.create(user=self.viewer, author=self.author)
+        self.assertEqual(self.subscriptions(self.client), [])
+
+    def test_write_pins_client_to_primary(self):
+        response = self.client.post(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(settings.DB_REPLICA_PIN_COOKIE, response.cookies)
+        self.assertEqual(self.subscriptions(self.client), [self.author.id])
+
+    def test_token_pin_is_shared_between_clients(self):
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(
+            self.subscriptions(self.token_client()), [self.author.id]
+        )
+
+    def test_pin_expires(self):
+        with override_settings(DB_REPLICA_PIN_SECONDS=0):
+            self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.subscriptions(self.token_client()), [])
+
+    def test_process_local_cache_is_rejected(self):
+        locmem = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}
+        with override_settings(CACHES=locmem):
+            with self.assertRaises(ImproperlyConfigured):
+                self.token_client().get('/api/users/subscriptions/')
+
+
+class ConnectionHealthCheckTests(TransactionTestCase):
+    """Живость соединения проверяется при первом обращении в запросе."""
+
+    def setUp(self):
+        connection.ensure_connection()
+        # Иначе close_old_connections сам проверит соединение после
+        # ошибок в предыдущих тестах или закроет его при CONN_MAX_AGE=0.
+        connection.errors_occurred = False
+        for patcher in (
+            mock.patch.dict(
+                connection.settings_dict,
+                CONN_HEALTH_CHECKS=True, CONN_MAX_AGE=None,
+            ),
+            mock.patch.object(connection, 'close_at', None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_check_is_deferred_to_first_query(self):
+        with mock.patch.object(
+            connection, 'is_usable', return_value=True
+        ) as is_usable:
+            request_started.send(sender=None)
+            is_usable.assert_not_called()
+            User.objects.exists()
+            User.objects.exists()
+        is_usable.assert_called_once_with()
+
+    def test_unusable_connection_is_closed(self):
+        failed = connection_stats['health_check_failed']
+        with mock.patch.object(
+            connection, 'is_usable', return_value=False
+        ), mock.patch.object(connection, 'close') as close:
+            request_started.send(sender=None)
+            User.objects.exists()
+        close.assert_called_once_with()
+        self.assertEqual(
+            connection_stats['health_check_failed'], failed + 1
+        )
+
+
+class MetricsViewTests(TestCase):
+    url = '/api/metrics/'
+
+    def test_without_token_only_staff_has_access(self):
+        staff = User.objects.create(
+            email='staff@example.com', username='staff',
+            first_name='Сотрудник', last_name='Тест', is_staff=True,
+        )
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(self.url).status_code, 401)
+            self.assertEqual(self.client.get(
+                self.url, HTTP_AUTHORIZATION='Bearer '
+            ).status_code, 401)
+            self.client.force_login(staff)
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_staff_with_api_token(self):
+        users = [
+            User.objects.create(
+                email=f'user{i}@example.com', username=f'user{i}',
+                first_name='Пользователь', last_name='Тест',
+                is_staff=is_staff,
+            )
+            for i, is_staff in enumerate((True, False))
+        ]
+        for user, status in zip(users, (200, 403)):
+            token = Token.objects.create(user=user)
+            with self.subTest(is_staff=user.is_staff):
+                response = self.client.get(
+                    self.url, HTTP_AUTHORIZATION=f'Token {token.key}',
+                    HTTP_ACCEPT='application/openmetrics-text',
+                )
+                self.assertEqual(response.status_code, status)
+        self.assertIn(b'foodgram_request_duration_seconds', self.client.get(
+            self.url, HTTP_AUTHORIZATION=f'Token {users[0].auth_token.key}'
+        ).content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        for authorization, status in (
+            ('Bearer secret', 200),
+            ('Bearer wrong', 401),
+            ('Bearer séсret', 401),
+            ('', 401),
+        ):
+            with self.subTest(authorization=authorization):
+                response = self.client.get(
+                    self.url, HTTP_AUTHORIZATION=authorization
+                )
+                self.assertEqual(response.status_code, status)
+
+
+class SlowQueryTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql(
+                "SELECT * FROM t\n  WHERE name = 'O''Brien' "
+                'AND id IN (1, 2, 3) AND score > 0.5 LIMIT %s'
+            ),
+            'SELECT * FROM t WHERE name = ? AND id IN (...) '
+            'AND score > ? LIMIT ?',
+        )
+        self.assertEqual(
+            normalize_sql('SELECT * FROM t2 WHERE id IN (%s, %s)'),
+            'SELECT * FROM t2 WHERE id IN (...)',
+        )
+
+    def test_fingerprint_ignores_literals(self):
+        first, second, other = (
+            fingerprint(normalize_sql(sql)) for sql in (
+                'SELECT * FROM t WHERE id = 1',
+                'SELECT  *  FROM t WHERE id = 42',
+                'SELECT * FROM t WHERE name = 1',
+            )
+        )
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(len(first), 16)
+
+    def test_slow_query_is_logged_with_call_site(self):
+        with override_settings(
+            SLOW_QUERY_DIR=self.directory, SLOW_QUERY_THRESHOLD_MS=0
+        ), mock.patch.multiple(slow_query_logger, pid=None, logger=None):
+            with connection.execute_wrapper(slow_query_logger):
+                change_counter(Recipe, 0, 'favorites_count', 1)
+            for handler in slow_query_logger.logger.handlers:
+                handler.close()
+        path, = Path(self.directory).glob(f'{LOG_FILE_PREFIX}-*')
+        entry, = (
+            json.loads(line) for line in path.read_text().splitlines()
+        )
+        self.assertTrue(entry['sql'].startswith('UPDATE "recipes_recipe"'))
+        self.assertEqual(
+            entry['fingerprint'], fingerprint(entry['sql'])
+        )
+        self.assertRegex(
+            entry['call_site'], r'^api/utils\.py:\d+ in change_counter$'
+        )
+
+    def write_log(self, *entries):
+        path = Path(self.directory) / f'{LOG_FILE_PREFIX}-1.ndjson'
+        lines = [json.dumps(entry) for entry in entries] + ['{broken']
+        path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    def summary(self, *args):
+        output = StringIO()
+        call_command(
+            'slowqueries', *args, dir=self.directory, stdout=output,
+            no_color=True,
+        )
+        return output.getvalue()
+
+    def test_slowqueries_summary(self):
+        def entry(sql, duration, time='2024-01-02T00:00:00+00:00'):
+            return {
+                'time': time, 'duration_ms': duration, 'sql': sql,
+                'fingerprint': fingerprint(sql),
+                'call_site': 'api/views.py:1 in list',
+            }
+
+        self.write_log(
+            entry('SELECT ?', 10),
+            entry('SELECT ?', 30),
+            entry('UPDATE t SET a = ?', 100),
+            entry('DELETE FROM t', 500, time='2023-12-31T00:00:00+00:00'),
+        )
+        output = self.summary('--since', '2024-01-01')
+        self.assertIn(
+            'Файлов: 1, отпечатков: 2, записей: 3, повреждённых строк: 1',
+            output,
+        )
+        self.assertLess(
+            output.index('UPDATE t SET a = ?'), output.index('SELECT ?')
+        )
+        self.assertIn(
+            f'#2 {fingerprint("SELECT ?")}: 2 раз, всего 40 мс, '
+            'среднее 20.0, p95 30.0, макс. 30.0 мс',
+            output,
+        )
+        self.assertIn('2 × api/views.py:1 in list', output)
+        output = self.summary('--sort', 'count', '--top', '1')
+        self.assertIn('#1 ' + fingerprint('SELECT ?'), output)
+        self.assertNotIn('#2', output)
+
+
+class ASGIHandlerTests(TransactionTestCase):
+    """Запросы под ASGI идут в своих потоках, а не по очереди."""
+
+    @async_to_sync
+    async def get(self, *paths):
+        async def request(path):
+            communicator = ApplicationCommunicator(application, {
+                'type': 'http', 'method': 'GET', 'path': path,
+                'query_string': b'', 'headers': [(b'host', b'testserver')],
+            })
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(ASGI_TIMEOUT)
+            body = b''
+            while True:
+                message = await communicator.receive_output(ASGI_TIMEOUT)
+                body += message.get('body', b'')
+                if not message.get('more_body'):
+                    return start['status'], body
+
+        return await asyncio.gather(*(request(path) for path in paths))
+
+    def test_requests_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=ASGI_TIMEOUT)
+
+        def wait_for_other_request(request, render):
+            barrier.wait()
+            return HttpResponse(b'[]', content_type='application/json')
+
+        with mock.patch.object(
+            tags_cache, 'response', side_effect=wait_for_other_request
+        ):
+            responses = self.get('/api/tags/', '/api/tags/')
+        self.assertEqual(responses, [(200, b'[]')] * 2)
+
+    def test_streaming_response_may_query_database(self):
+        User.objects.create(
+            email='user@example.com', username='user',
+            first_name='Пользователь', last_name='Тест',
+        )
+
+        def stream(request, render):
+            return StreamingHttpResponse(
+                str(User.objects.count()) for _ in range(2)
+            )
+
+        with mock.patch.object(tags_cache, 'response', side_effect=stream):
+            (status, body), = self.get('/api/tags/')
+        self.assertEqual((status, body), (200, b'11'))
@@ -0,0 +1,16 @@
+from uvicorn.workers import UvicornWorker as BaseUvicornWorker
+
+
+class UvicornWorker(BaseUvicornWorker):
+    """Uvicorn-воркер gunicorn для foodgram.asgi.
+
+    Django 3.2 не поддерживает протокол lifespan. worker_connections
+    ограничивает число одновременных запросов: каждый занимает свой
+    поток и своё соединение с базой, а лишние получают 503.
+    """
+
+    CONFIG_KWARGS = {'loop': 'auto', 'http': 'auto', 'lifespan': 'off'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config.limit_concurrency = self.cfg.worker_connections
@@ -0,0 +1,51 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(
+    os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+)
+# wsgi — синхронные воркеры, где медленный клиент занимает весь
+# воркер; asgi — uvicorn, где он занимает только поток своего запроса.
+interface = os.getenv('GUNICORN_INTERFACE', 'wsgi')
+if interface == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'foodgram.workers.UvicornWorker'
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 50))
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+    worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Перезапуск воркеров ограничивает утечки памяти, а разброс не даёт
+# всем воркерам заново открыть соединения с базой одновременно.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+accesslog = os.getenv('GUNICORN_ACCESSLOG', '-') or None
+# Воркеры пишут метрики Prometheus в общий каталог, а /api/metrics/
+# собирает их со всех воркеров. Переменная должна быть задана до
+# импорта prometheus_client в воркерах.
+os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram-metrics'),
+)
+
+
+def on_starting(server):
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    from foodgram.db import get_connection_stats
+
+    server.log.info('DB connections: %s', get_connection_stats())
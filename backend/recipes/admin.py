@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from foodgram.paginators import EstimatedCountPaginator
 from recipes.models import (Tag, Ingredient, IngredientMeasure,
                             Favorite, ShoppingCart, Recipe)
 
@@ -8,12 +9,24 @@ class Ingredients(admin.TabularInline):
     model = IngredientMeasure
     min_num = 1
     extra = 1
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
     search_fields = ('name',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'color')
+    search_fields = ('name', 'slug')
 
 
 @admin.register(Recipe)
@@ -28,26 +41,43 @@ class RecipeAdmin(admin.ModelAdmin):
         'author',
         'in_favorites'
     )
-    list_editable = (
-        'name', 'cooking_time', 'tags',
-        'image', 'author'
-    )
+    list_editable = ('name', 'cooking_time')
+    list_select_related = ('author',)
     readonly_fields = ('in_favorites',)
-    search_fields = ('name', 'author')
+    search_fields = ('name', 'author__username')
     list_filter = ('tags',)
+    autocomplete_fields = ('author', 'tags')
     inlines = (Ingredients,)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('tags')
 
     @admin.display(description='Тэги')
     def tags(self, obj):
         list_ = [_.name for _ in obj.tags.all()]
         return ', '.join(list_)
 
-    @admin.display(description='В избранном')
+    @admin.display(description='В избранном', ordering='favorites_count')
     def in_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
+
+
+@admin.register(IngredientMeasure)
+class IngredientMeasureAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'ingredient', 'amount')
+    list_select_related = ('recipe', 'ingredient')
+    raw_id_fields = ('recipe',)
+    autocomplete_fields = ('ingredient',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
-admin.site.register(Tag)
-admin.site.register(IngredientMeasure)
-admin.site.register(Favorite)
-admin.site.register(ShoppingCart)
+@admin.register(Favorite, ShoppingCart)
+class UserRecipeAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    raw_id_fields = ('user', 'recipe')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from .models import Recipe, delete_search_index
+
+        post_delete.connect(
+            delete_search_index, sender=Recipe,
+            dispatch_uid='recipe_delete_search_index'
+        )
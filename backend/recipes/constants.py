@@ -5,3 +5,37 @@ COOKING_TIME_MIN_VALUE = 1
 INGREDIENT_AMOUNT_MIN_VALUE = 1
 DEFAULT_HEX_COLOR = '#CD5C5C'
 HEX_COLOR_REGULAR_EXPRESSION = '^#(?:[0-9a-fA-F]{3}){1,2}$'
+IMAGE_VARIANTS = (
+    ('thumbnail', 160),
+    ('card', 480),
+    ('full', 1280),
+)
+IMAGE_VARIANT_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+IMAGE_VARIANTS_DIR = 'recipes/variants'
+IMAGE_BACKGROUND_COLOR = (255, 255, 255)
+IMAGE_WORKER_BATCH_SIZE = 50
+IMAGE_WORKER_INTERVAL = 5
+IMAGE_MAX_ATTEMPTS = 3
+IMAGE_ERROR_KEY = 'error'
+SEARCH_CONFIG = 'russian'
+SEARCH_HIGHLIGHT_START = '<b>'
+SEARCH_HIGHLIGHT_STOP = '</b>'
+SEARCH_FTS_TABLE = 'recipes_recipe_fts'
+FEED_FANOUT_MAX_FOLLOWERS = 5000
+FEED_RETENTION = 500
+FEED_BACKFILL_SIZE = 50
+FEED_INSERT_BATCH_SIZE = 1000
+FEED_WORKER_BATCH_SIZE = 20
+FEED_WORKER_INTERVAL = 5
+FEED_TRIM_BATCH_SIZE = 500
+SIMILAR_RECIPES_TOP = 10
+SIMILAR_TAG_WEIGHT = 0.5
+SIMILAR_MAX_INGREDIENT_SHARE = 0.2
+SIMILAR_COMMON_INGREDIENT_MIN_RECIPES = 100
+SIMILAR_CHUNK_SIZE = 500
+SIMILAR_INSERT_BATCH_SIZE = 5000
+SIMILAR_WORKER_INTERVAL = 60
+SHOPPING_LIST_REBUILD_BATCH_SIZE = 500
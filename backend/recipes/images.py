@@ -0,0 +1,88 @@
+import os
+import sys
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .constants import (IMAGE_BACKGROUND_COLOR, IMAGE_ERROR_KEY,
+                        IMAGE_VARIANT_FORMATS, IMAGE_VARIANTS,
+                        IMAGE_VARIANTS_DIR)
+
+
+def flatten(image):
+    if image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, IMAGE_BACKGROUND_COLOR)
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image
+
+
+def build_variants(image_name):
+    with default_storage.open(image_name) as file:
+        source = Image.open(file)
+        source.load()
+    source = ImageOps.exif_transpose(source)
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA')
+    opaque = flatten(source)
+    base_name = os.path.splitext(os.path.basename(image_name))[0]
+    variants = {}
+    for variant, width in IMAGE_VARIANTS:
+        variant_data = {}
+        for extension, image_format, options in IMAGE_VARIANT_FORMATS:
+            image = (source if image_format == 'WEBP' else opaque).copy()
+            image.thumbnail((width, sys.maxsize), Image.LANCZOS)
+            buffer = BytesIO()
+            image.save(buffer, image_format, **options)
+            variant_data[extension] = default_storage.save(
+                f'{IMAGE_VARIANTS_DIR}/{base_name}_{variant}.{extension}',
+                ContentFile(buffer.getvalue())
+            )
+            variant_data['width'], variant_data['height'] = image.size
+        variants[variant] = variant_data
+    return variants
+
+
+def failure(error, variants=None):
+    """Отметка о неудаче с числом попыток вместо вариантов."""
+    return {
+        IMAGE_ERROR_KEY: error,
+        'attempts': failed_attempts(variants) + 1,
+    }
+
+
+def failed_attempts(variants):
+    if variants and IMAGE_ERROR_KEY in variants:
+        return variants['attempts']
+    return 0
+
+
+def variant_files(variants):
+    if not variants or IMAGE_ERROR_KEY in variants:
+        return []
+    return [
+        data[extension]
+        for data in variants.values()
+        for extension, _, _ in IMAGE_VARIANT_FORMATS
+    ]
+
+
+def delete_variants(variants):
+    for name in variant_files(variants):
+        default_storage.delete(name)
+
+
+def variant_urls(variants, request=None):
+    urls = {}
+    if not variant_files(variants):
+        return urls
+    for variant, data in variants.items():
+        urls[variant] = {'width': data['width'], 'height': data['height']}
+        for extension, _, _ in IMAGE_VARIANT_FORMATS:
+            url = default_storage.url(data[extension])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[variant][extension] = url
+    return urls
@@ -0,0 +1,190 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from recipes.constants import (SIMILAR_CHUNK_SIZE, SIMILAR_RECIPES_TOP,
+                               SIMILAR_WORKER_INTERVAL)
+from recipes.models import IngredientMeasure, Recipe, SimilarRecipe
+from recipes.similarity import (build_matrices, common_limit, scores,
+                                set_matrices, top_neighbours)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает похожие рецепты по ингредиентам и тегам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересчитать похожие для всех рецептов',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Работать постоянно, пересчитывая изменённые рецепты',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=SIMILAR_CHUNK_SIZE
+        )
+        parser.add_argument('--top', type=int, default=SIMILAR_RECIPES_TOP)
+        parser.add_argument(
+            '--interval', type=float, default=SIMILAR_WORKER_INTERVAL
+        )
+
+    def handle(self, *args, **options):
+        rebuild = options['all']
+        while True:
+            changed_ids = self.take_changed()
+            if rebuild or changed_ids:
+                try:
+                    self.build(changed_ids, rebuild, options)
+                except BaseException:
+                    Recipe.objects.filter(id__in=changed_ids).update(
+                        similar_outdated=True
+                    )
+                    raise
+            if not options['loop']:
+                break
+            rebuild = False
+            time.sleep(options['interval'])
+
+    @staticmethod
+    def take_changed():
+        """Забирает изменённые рецепты, снимая с них флаг.
+
+        Флаг снимается до чтения данных: правка во время пересчёта
+        снова его поставит, и рецепт попадёт в следующий проход.
+        """
+        with transaction.atomic():
+            changed_ids = list(
+                Recipe.objects.select_for_update().filter(
+                    similar_outdated=True
+                ).order_by('id').values_list('id', flat=True)
+            )
+            Recipe.objects.filter(id__in=changed_ids).update(
+                similar_outdated=False
+            )
+        return changed_ids
+
+    @staticmethod
+    def affected_recipes(changed_ids):
+        """Изменённые рецепты и рецепты с общими с ними ингредиентами.
+
+        Остальные рецепты с изменёнными не схожи, поэтому не читаются.
+        Общие ингредиенты считаются по всей базе, как при полном
+        пересчёте.
+        """
+        common = list(
+            IngredientMeasure.objects.values('ingredient_id').annotate(
+                recipes=Count('id')
+            ).filter(
+                recipes__gt=common_limit(Recipe.objects.count())
+            ).order_by().values_list('ingredient_id', flat=True)
+        )
+        shared = IngredientMeasure.objects.filter(
+            recipe_id__in=changed_ids
+        ).exclude(ingredient_id__in=common).values('ingredient_id')
+        recipes = Recipe.objects.filter(
+            Q(id__in=changed_ids)
+            | Q(id__in=IngredientMeasure.objects.filter(
+                ingredient_id__in=shared
+            ).values('recipe_id'))
+        )
+        return recipes, common
+
+    def build(self, changed_ids, rebuild, options):
+        started = time.monotonic()
+        measures = IngredientMeasure.objects.all()
+        recipe_tags = Recipe.tags.through.objects.all()
+        if rebuild:
+            recipes, common = Recipe.objects.all(), None
+        else:
+            recipes, common = self.affected_recipes(changed_ids)
+            measures = measures.filter(recipe__in=recipes)
+            recipe_tags = recipe_tags.filter(recipe__in=recipes)
+        recipe_ids = np.fromiter(
+            recipes.order_by('id').values_list('id', flat=True).iterator(),
+            dtype=np.int64,
+        )
+        ingredients, tags = build_matrices(
+            recipe_ids,
+            list(measures.values_list(
+                'recipe_id', 'ingredient_id'
+            ).iterator()),
+            list(recipe_tags.values_list('recipe_id', 'tag_id').iterator()),
+            common,
+        )
+        set_matrices(ingredients, tags)
+        if rebuild:
+            rows = np.arange(len(recipe_ids))
+        else:
+            rows = np.searchsorted(recipe_ids, changed_ids)
+            rows = rows[rows < len(recipe_ids)]
+            rows = rows[np.isin(recipe_ids[rows], changed_ids)]
+        chunks = [
+            rows[start:start + options['chunk_size']]
+            for start in range(0, len(rows), options['chunk_size'])
+        ]
+        if options['workers'] > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                initializer=set_matrices,
+                initargs=(ingredients, tags),
+            ) as pool:
+                self.store(
+                    recipe_ids,
+                    pool.map(
+                        top_neighbours, chunks, [options['top']] * len(chunks)
+                    ),
+                )
+        else:
+            self.store(
+                recipe_ids,
+                (top_neighbours(chunk, options['top']) for chunk in chunks),
+            )
+        if not rebuild:
+            self.link_back(recipe_ids, rows, chunks, options['top'])
+        self.stdout.write(
+            f'Пересчитано рецептов: {len(rows)} '
+            f'за {time.monotonic() - started:.1f} с'
+        )
+
+    @staticmethod
+    def store(recipe_ids, results):
+        for result in results:
+            SimilarRecipe.objects.replace({
+                int(recipe_ids[row]): [
+                    (int(recipe_ids[column]), score)
+                    for column, score in zip(columns, values)
+                ]
+                for row, columns, values in result
+            })
+
+    @staticmethod
+    def link_back(recipe_ids, rows, chunks, top):
+        changed = set(rows.tolist())
+        links = []
+        for chunk in chunks:
+            chunk_scores = scores(chunk).tocoo()
+            links.extend(
+                (
+                    int(recipe_ids[column]),
+                    int(recipe_ids[chunk[row]]),
+                    float(score),
+                )
+                for row, column, score in zip(
+                    chunk_scores.row, chunk_scores.col, chunk_scores.data
+                )
+                if column not in changed
+            )
+        SimilarRecipe.objects.link_back(
+            recipe_ids[rows].tolist(), links, top
+        )
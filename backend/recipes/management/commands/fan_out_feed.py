@@ -0,0 +1,49 @@
+import time
+
+from django.core.management import BaseCommand
+
+from recipes.constants import (FEED_TRIM_BATCH_SIZE, FEED_WORKER_BATCH_SIZE,
+                               FEED_WORKER_INTERVAL)
+from recipes.models import FeedEntry, Recipe
+
+
+class Command(BaseCommand):
+    help = 'Рассылает новые рецепты в ленты подписчиков авторов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Работать постоянно, ожидая новые рецепты',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=FEED_WORKER_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--interval', type=float, default=FEED_WORKER_INTERVAL
+        )
+
+    def handle(self, *args, **options):
+        pending = Recipe.objects.filter(fanned_out=False).select_related(
+            'author'
+        ).order_by('id')
+        while True:
+            touched = set()
+            while True:
+                batch = list(pending[:options['batch_size']])
+                if not batch:
+                    break
+                for recipe in batch:
+                    touched.update(FeedEntry.objects.fan_out(recipe))
+                self.stdout.write(f'Разослано рецептов: {len(batch)}')
+            self.trim(touched)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def trim(self, user_ids):
+        user_ids = sorted(user_ids)
+        for start in range(0, len(user_ids), FEED_TRIM_BATCH_SIZE):
+            FeedEntry.objects.trim(
+                user_ids[start:start + FEED_TRIM_BATCH_SIZE]
+            )
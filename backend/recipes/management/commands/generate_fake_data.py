@@ -0,0 +1,458 @@
+import csv
+import json
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from itertools import islice
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError, call_command
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.utils import timezone
+from PIL import Image
+
+from recipes.constants import IMAGE_ERROR_KEY
+from recipes.images import build_variants
+from recipes.models import (Favorite, FeedEntry, Ingredient, IngredientMeasure,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag)
+from users.models import Follow, User
+
+DEFAULT_BATCH_SIZE = 50000
+DEFAULT_PASSWORD = 'fake-password'
+OVERSAMPLE = 2
+PLACEHOLDER_DIR = 'recipes/fake'
+PLACEHOLDER_SIZE = (1280, 854)
+INGREDIENTS_COUNT = 2000
+MAX_INGREDIENTS_PER_RECIPE = 30
+MAX_RECIPES_PER_USER = 1000
+TAGS = (
+    ('Завтрак', 'breakfast'),
+    ('Обед', 'lunch'),
+    ('Ужин', 'dinner'),
+    ('Десерт', 'dessert'),
+    ('Выпечка', 'bakery'),
+    ('Постное', 'lenten'),
+)
+UNITS = ('г', 'мл', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей', 'Алёна')
+LAST_NAMES = ('Иванов', 'Смирнова', 'Кузнецов', 'Попова', 'Соколов', 'Орлова')
+DISHES = (
+    'Суп', 'Салат', 'Пирог', 'Омлет', 'Плов', 'Борщ', 'Рагу', 'Запеканка',
+    'Каша', 'Паста', 'Блины', 'Котлеты',
+)
+STYLES = (
+    'по-домашнему', 'по-деревенски', 'на скорую руку', 'с зеленью',
+    'с сыром', 'с грибами', 'со свёклой', 'в духовке',
+)
+SENTENCES = (
+    'Нарежьте овощи кубиками и обжарьте до золотистого цвета.',
+    'Добавьте специи и тушите под крышкой пятнадцать минут.',
+    'Взбейте яйца с молоком и щепоткой соли.',
+    'Запекайте в разогретой духовке до румяной корочки.',
+    'Подавайте горячим, посыпав свежей зеленью.',
+    'Замесите тесто и дайте ему отдохнуть полчаса.',
+    'Отварите крупу в подсоленной воде до мягкости.',
+    'Смешайте всё в большой миске и охладите.',
+)
+
+
+def zipf_choice(rng, size, count, skew):
+    """Индексы 0..size-1, где индекс i выпадает с частотой ~ 1/(i+1)^skew."""
+    weights = 1 / np.arange(1, size + 1) ** skew
+    return rng.choice(size, count, p=weights / weights.sum())
+
+
+def per_parent(rng, parents, mean, low, high):
+    return np.clip(rng.poisson(mean, parents), low, high)
+
+
+def draw_pairs(counts, choose):
+    """Пары (родитель, потомок) без повторов, у родителя i — до counts[i].
+
+    choose(n) возвращает n случайных потомков. При перекошенном
+    распределении повторы часты, поэтому потомков берётся с запасом,
+    а лишние после удаления повторов отбрасываются.
+    """
+    rows = np.repeat(np.arange(len(counts)), counts * OVERSAMPLE)
+    children = choose(len(rows))
+    width = int(children.max()) + 1 if len(children) else 1
+    keys = np.unique(rows * width + children)
+    rows, children = keys // width, keys % width
+    position = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = position < counts[rows]
+    return rows[keep], children[keep]
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует пользователей, рецепты, подписки, избранное и корзины '
+        'с реалистичным перекосом популярности'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=float, default=10,
+            help='Среднее число ингредиентов в рецепте',
+        )
+        parser.add_argument(
+            '--tags-per-recipe', type=float, default=1.5,
+            help='Среднее число тегов у рецепта',
+        )
+        parser.add_argument(
+            '--follows-per-user', type=float, default=20,
+            help='Среднее число подписок нового пользователя',
+        )
+        parser.add_argument('--favorites-per-user', type=float, default=30)
+        parser.add_argument('--carts-per-user', type=float, default=3)
+        parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help='Показатель закона Ципфа для популярности авторов, '
+                 'рецептов и ингредиентов',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько дней распределить даты публикации',
+        )
+        parser.add_argument(
+            '--feeds',
+            action='store_true',
+            help='Заполнить ленты новых пользователей, как после подписки',
+        )
+        parser.add_argument('--images', type=int, default=8)
+        parser.add_argument('--password', default=DEFAULT_PASSWORD)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY даже на PostgreSQL',
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь')
+        self.rng = np.random.default_rng(options['seed'])
+        self.batch_size = options['batch_size']
+        self.use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        self.skew = options['skew']
+        started = time.perf_counter()
+        images = self.placeholders(options['images'])
+        with transaction.atomic():
+            ingredient_ids, tag_ids = self.dictionaries()
+            user_ids, first_user_id = self.users(options)
+            authors = user_ids[self.rng.permutation(len(user_ids))]
+            recipe_ids = self.recipes(options, authors, images)
+            self.recipe_ingredients(options, recipe_ids, ingredient_ids)
+            self.recipe_tags(options, recipe_ids, tag_ids)
+            new_users = np.arange(first_user_id, user_ids[-1] + 1)
+            self.follows(options, new_users, authors)
+            shuffled = recipe_ids[self.rng.permutation(len(recipe_ids))]
+            for model, per_user in (
+                (Favorite, options['favorites_per_user']),
+                (ShoppingCart, options['carts_per_user']),
+            ):
+                self.user_recipes(model, per_user, new_users, shuffled)
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [User, Recipe]
+                ):
+                    cursor.execute(sql)
+            self.derived_data(first_user_id, recipe_ids, options['feeds'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {time.perf_counter() - started:.1f} с. '
+            'Похожие рецепты посчитает build_similar_recipes'
+        ))
+
+    def placeholders(self, count):
+        """Несколько общих картинок на все рецепты вместо файла на каждый."""
+        images = []
+        for index in range(max(count, 1)):
+            name = f'{PLACEHOLDER_DIR}/placeholder_{index}.png'
+            variants = Recipe.objects.filter(
+                image=name, image_variants__isnull=False
+            ).exclude(
+                image_variants__has_key=IMAGE_ERROR_KEY
+            ).values_list('image_variants', flat=True).first()
+            if not default_storage.exists(name):
+                buffer = BytesIO()
+                Image.new(
+                    'RGB', PLACEHOLDER_SIZE,
+                    ((index * 97) % 256, (index * 53 + 96) % 256, 160),
+                ).save(buffer, 'PNG')
+                name = default_storage.save(
+                    name, ContentFile(buffer.getvalue())
+                )
+                variants = None
+            if variants is None:
+                variants = build_variants(name)
+            images.append((name, json.dumps(variants)))
+        return images
+
+    def dictionaries(self):
+        if not Ingredient.objects.exists():
+            self.write(
+                Ingredient, ('name', 'measurement_unit'),
+                (
+                    (f'ингредиент {index}', UNITS[index % len(UNITS)])
+                    for index in range(INGREDIENTS_COUNT)
+                ),
+            )
+        if not Tag.objects.exists():
+            self.write(
+                Tag, ('name', 'slug', 'color'),
+                (
+                    (name, slug, f'#{index * 40:02X}7F50')
+                    for index, (name, slug) in enumerate(TAGS)
+                ),
+            )
+        return (
+            np.array(Ingredient.objects.order_by('id').values_list(
+                'id', flat=True
+            ), dtype=np.int64),
+            np.array(Tag.objects.order_by('id').values_list(
+                'id', flat=True
+            ), dtype=np.int64),
+        )
+
+    def users(self, options):
+        first_id = self.next_id(User)
+        password = make_password(options['password'])
+        first_names = self.rng.integers(
+            len(FIRST_NAMES), size=options['users']
+        )
+        last_names = self.rng.integers(len(LAST_NAMES), size=options['users'])
+        self.write(
+            User,
+            ('id', 'email', 'username', 'first_name', 'last_name', 'password'),
+            (
+                (
+                    first_id + index,
+                    f'fake{first_id + index}@example.com',
+                    f'fake{first_id + index}',
+                    FIRST_NAMES[first_name],
+                    LAST_NAMES[last_name],
+                    password,
+                )
+                for index, (first_name, last_name) in enumerate(zip(
+                    first_names.tolist(), last_names.tolist()
+                ))
+            ),
+        )
+        return (
+            np.array(User.objects.order_by('id').values_list(
+                'id', flat=True
+            ), dtype=np.int64),
+            first_id,
+        )
+
+    def recipes(self, options, authors, images):
+        count = options['recipes']
+        first_id = self.next_id(Recipe)
+        recipe_ids = np.arange(first_id, first_id + count, dtype=np.int64)
+        author_ids = authors[zipf_choice(
+            self.rng, len(authors), count, self.skew
+        )]
+        now = timezone.now()
+        ages = np.sort(
+            self.rng.integers(options['days'] * 86400, size=count)
+        )[::-1]
+        dishes = self.rng.integers(len(DISHES), size=count)
+        styles = self.rng.integers(len(STYLES), size=count)
+        sentences = self.rng.integers(len(SENTENCES), size=(count, 3))
+        cooking_times = self.rng.integers(5, 180, size=count)
+        adapt = connection.ops.adapt_datetimefield_value
+        self.write(
+            Recipe,
+            (
+                'id', 'author_id', 'name', 'text', 'pub_date', 'image',
+                'image_variants', 'cooking_time', 'fanned_out',
+            ),
+            (
+                (
+                    recipe_id,
+                    author_id,
+                    f'{DISHES[dish]} {STYLES[style]} №{recipe_id}',
+                    ' '.join(SENTENCES[index] for index in text),
+                    adapt(now - timedelta(seconds=age)),
+                    *images[recipe_id % len(images)],
+                    cooking_time,
+                    True,
+                )
+                for recipe_id, author_id, dish, style, text, age, cooking_time
+                in zip(
+                    recipe_ids.tolist(), author_ids.tolist(), dishes.tolist(),
+                    styles.tolist(), sentences.tolist(), ages.tolist(),
+                    cooking_times.tolist(),
+                )
+            ),
+        )
+        return recipe_ids
+
+    def recipe_ingredients(self, options, recipe_ids, ingredient_ids):
+        popularity = self.rng.permutation(len(ingredient_ids))
+        rows, ingredients = draw_pairs(
+            per_parent(
+                self.rng, len(recipe_ids), options['ingredients_per_recipe'],
+                1, min(MAX_INGREDIENTS_PER_RECIPE, len(ingredient_ids)),
+            ),
+            lambda count: popularity[zipf_choice(
+                self.rng, len(ingredient_ids), count, self.skew
+            )],
+        )
+        amounts = self.rng.integers(1, 500, size=len(rows))
+        self.write(
+            IngredientMeasure, ('recipe_id', 'ingredient_id', 'amount'),
+            zip(
+                recipe_ids[rows].tolist(),
+                ingredient_ids[ingredients].tolist(),
+                amounts.tolist(),
+            ),
+        )
+
+    def recipe_tags(self, options, recipe_ids, tag_ids):
+        rows, tags = draw_pairs(
+            per_parent(
+                self.rng, len(recipe_ids), options['tags_per_recipe'],
+                1, len(tag_ids),
+            ),
+            lambda count: self.rng.integers(len(tag_ids), size=count),
+        )
+        self.write(
+            Recipe.tags.through, ('recipe_id', 'tag_id'),
+            zip(recipe_ids[rows].tolist(), tag_ids[tags].tolist()),
+        )
+
+    def follows(self, options, new_users, authors):
+        rows, followed = draw_pairs(
+            per_parent(
+                self.rng, len(new_users), options['follows_per_user'],
+                0, len(authors) - 1,
+            ),
+            lambda count: zipf_choice(
+                self.rng, len(authors), count, self.skew
+            ),
+        )
+        user_ids, author_ids = new_users[rows], authors[followed]
+        other = user_ids != author_ids
+        self.write(
+            Follow, ('user_id', 'author_id'),
+            zip(user_ids[other].tolist(), author_ids[other].tolist()),
+        )
+
+    def user_recipes(self, model, per_user, new_users, recipe_ids):
+        if not len(recipe_ids):
+            return
+        rows, recipes = draw_pairs(
+            per_parent(
+                self.rng, len(new_users), per_user,
+                0, min(MAX_RECIPES_PER_USER, len(recipe_ids)),
+            ),
+            lambda count: zipf_choice(
+                self.rng, len(recipe_ids), count, self.skew
+            ),
+        )
+        self.write(
+            model, ('user_id', 'recipe_id'),
+            zip(new_users[rows].tolist(), recipe_ids[recipes].tolist()),
+        )
+
+    def derived_data(self, first_user_id, recipe_ids, feeds):
+        started = time.perf_counter()
+        if len(recipe_ids):
+            Recipe.objects.filter(
+                id__gte=recipe_ids[0]
+            ).update_search_index()
+        call_command('reconcile_counters', stdout=StringIO())
+        totals = IngredientMeasure.objects.filter(
+            recipe__shopping_cart__user_id__gte=first_user_id
+        ).values(
+            'ingredient_id', user_id=models.F('recipe__shopping_cart__user')
+        ).annotate(total_amount=models.Sum('amount')).order_by()
+        sql, params = totals.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {ShoppingListItem._meta.db_table} '
+                '(user_id, ingredient_id, total_amount) '
+                'SELECT totals.user_id, totals.ingredient_id, '
+                f'totals.total_amount FROM ({sql}) totals',
+                params
+            )
+        if feeds:
+            FeedEntry.objects.fill(
+                Follow.objects.filter(user_id__gte=first_user_id)
+            )
+        self.stdout.write(
+            'Поисковый индекс, счётчики и списки покупок: '
+            f'{time.perf_counter() - started:.1f} с'
+        )
+
+    @staticmethod
+    def next_id(model):
+        last = model.objects.aggregate(last=models.Max('id'))['last']
+        return (last or 0) + 1
+
+    def write(self, model, columns, rows):
+        """Пишет строки пачками через COPY или executemany.
+
+        Колонки модели, которых нет в columns, получают значения
+        по умолчанию из полей.
+        """
+        started = time.perf_counter()
+        defaults = [
+            (field, field.get_db_prep_save(field.get_default(), connection))
+            for field in model._meta.concrete_fields
+            if field.attname not in columns and not field.primary_key
+        ]
+        default_values = tuple(value for _, value in defaults)
+        names = ', '.join(
+            connection.ops.quote_name(name)
+            for name in (
+                *(model._meta.get_field(column).column for column in columns),
+                *(field.column for field, _ in defaults),
+            )
+        )
+        table = connection.ops.quote_name(model._meta.db_table)
+        total = 0
+        with connection.cursor() as cursor:
+            for batch in batches(rows, self.batch_size):
+                batch = [row + default_values for row in map(tuple, batch)]
+                if self.use_copy:
+                    buffer = StringIO()
+                    csv.writer(buffer).writerows(batch)
+                    buffer.seek(0)
+                    cursor.cursor.copy_expert(
+                        f'COPY {table} ({names}) FROM STDIN WITH (FORMAT csv)',
+                        buffer
+                    )
+                else:
+                    placeholders = ', '.join(['%s'] * len(batch[0]))
+                    cursor.executemany(
+                        f'INSERT INTO {table} ({names}) '
+                        f'VALUES ({placeholders})',
+                        batch
+                    )
+                total += len(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{model._meta.label}: {total} строк за '
+            f'{elapsed:.1f} с, {total / max(elapsed, 1e-9):.0f} строк/с'
+        )
@@ -1,20 +1,292 @@
 import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
 
-from recipes.models import Ingredient
+from api.cache import ingredients_cache, tags_cache
+from recipes.models import Ingredient, Tag
+
+DEFAULT_BATCH_SIZE = 5000
+JSON_CHUNK_SIZE = 64 * 1024
+
+MODELS = {
+    'ingredients': {
+        'model': Ingredient,
+        'fields': ('name', 'measurement_unit'),
+        'csv_columns': ('name', 'measurement_unit'),
+        'unique_fields': ('name', 'measurement_unit'),
+        'cache': ingredients_cache,
+    },
+    'tags': {
+        'model': Tag,
+        'fields': ('name', 'color', 'slug'),
+        'csv_columns': ('id', 'name', 'color', 'slug'),
+        'unique_fields': ('slug',),
+        'other_unique_fields': ('name', 'color'),
+        'cache': tags_cache,
+    },
+}
+
+
+def read_csv(file, columns):
+    reader = csv.reader(file)
+    first_row = next(reader, None)
+    if first_row is None:
+        return
+    if set(columns) - {'id'} <= set(first_row):
+        columns = first_row
+    else:
+        yield dict(zip(columns, first_row))
+    for row in reader:
+        yield dict(zip(columns, row))
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('JSON должен быть списком объектов')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Некорректный JSON')
+                break
+            yield item.get('fields', item)
+        if not chunk:
+            return
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты и теги из CSV или JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*',
+            help=f'Модели из {", ".join(MODELS)}, по умолчанию все',
+        )
+        parser.add_argument(
+            '--path',
+            help='Файл с данными, по умолчанию data/<модель>.csv',
+        )
+        parser.add_argument('--format', choices=('csv', 'json'))
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help='Обновлять существующие записи вместо пропуска',
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY даже на PostgreSQL',
+        )
+
+    def handle(self, *args, **options):
+        models = options['models'] or tuple(MODELS)
+        unknown = set(models) - set(MODELS)
+        if unknown:
+            raise CommandError(f'Неизвестные модели: {", ".join(unknown)}')
+        if options['path'] and len(models) != 1:
+            raise CommandError('С --path укажите ровно одну модель')
+        use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        for name in models:
+            path = Path(
+                options['path']
+                or Path(settings.BASE_DIR) / 'data' / f'{name}.csv'
+            )
+            file_format = options['format'] or path.suffix.lstrip('.')
+            if file_format not in ('csv', 'json'):
+                raise CommandError(f'Неизвестный формат файла {path}')
+            self.load(
+                MODELS[name], path, file_format, options['batch_size'],
+                options['update'], use_copy
+            )
+
+    def load(self, spec, path, file_format, batch_size, update, use_copy):
+        model = spec['model']
+        start = time.perf_counter()
+        total = 0
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = (
+                read_csv(file, spec['csv_columns'])
+                if file_format == 'csv' else read_json(file)
+            )
+            rows = (
+                tuple(str(row[field]).strip() for field in spec['fields'])
+                for row in rows
+            )
+            with transaction.atomic():
+                for batch in batches(rows, batch_size):
+                    if use_copy:
+                        self.copy_batch(spec, batch, update)
+                    else:
+                        self.create_batch(spec, batch, update)
+                    total += len(batch)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f'{model._meta.verbose_name_plural}: '
+                        f'{total} строк, {total / elapsed:.0f} строк/с'
+                    )
+        spec['cache'].bump()
+        self.stdout.write(self.style.SUCCESS(
+            f'{path.name}: обработано {total} строк за '
+            f'{time.perf_counter() - start:.2f} с'
+        ))
+
+    @staticmethod
+    def update_fields(spec):
+        return [
+            field for field in spec['fields']
+            if field not in spec['unique_fields']
+        ]
+
+    def create_batch(self, spec, batch, update):
+        model = spec['model']
+        rows = [dict(zip(spec['fields'], row)) for row in batch]
+        update_fields = self.update_fields(spec)
+        if update and update_fields:
+            rows = self.update_existing(spec, rows, update_fields)
+        model.objects.bulk_create(
+            [model(**row) for row in rows], ignore_conflicts=True
+        )
+
+    def update_existing(self, spec, rows, update_fields):
+        """Обновляет уже загруженные записи и возвращает только новые.
+
+        В Django 3.2 у bulk_create нет update_conflicts, поэтому
+        записи ищутся по ключу и меняются через bulk_update. Строка
+        пропускается, если значение другого уникального поля уже
+        занято записью с другим ключом: в базе или раньше в пачке.
+        """
+        model = spec['model']
+        key_fields = spec['unique_fields']
+        other_fields = spec.get('other_unique_fields', ())
+        existing = {
+            tuple(getattr(obj, field) for field in key_fields): obj
+            for obj in model.objects.filter(**{
+                f'{key_fields[0]}__in': {row[key_fields[0]] for row in rows}
+            })
+        }
+        taken = {
+            field: {
+                value: tuple(key)
+                for value, *key in model.objects.filter(**{
+                    f'{field}__in': {row[field] for row in rows}
+                }).values_list(field, *key_fields)
+            }
+            for field in other_fields
+        }
+        seen = set()
+        to_update, to_create = [], []
+        for row in rows:
+            key = tuple(row[field] for field in key_fields)
+            if key in seen or any(
+                taken[field].get(row[field], key) != key
+                for field in other_fields
+            ):
+                continue
+            seen.add(key)
+            for field in other_fields:
+                taken[field][row[field]] = key
+            obj = existing.get(key)
+            if obj is None:
+                to_create.append(row)
+                continue
+            for field in update_fields:
+                setattr(obj, field, row[field])
+            to_update.append(obj)
+        model.objects.bulk_update(to_update, update_fields)
+        return to_create
+
+    def copy_batch(self, spec, batch, update):
+        """Загружает пачку через COPY во временную таблицу и INSERT.
 
-    def handle(self, *args, **kwargs):
-        data_path = settings.BASE_DIR
-        with open(
-            f'{data_path}/data/ingredients.csv',
-            'r',
-            encoding='utf-8'
-        ) as file:
-            reader = csv.DictReader(file)
-            Ingredient.objects.bulk_create(
-                Ingredient(**data) for data in reader)
+        Из пачки берётся по одной строке на каждое значение ключа и
+        других уникальных полей. Строки, чьё значение другого
+        уникального поля уже занято записью с другим ключом,
+        пропускаются, а конфликт по ключу пропускает или обновляет
+        запись.
+        """
+        table = spec['model']._meta.db_table
+        columns = ', '.join(spec['fields'])
+        key_fields = spec['unique_fields']
+        other_fields = spec.get('other_unique_fields', ())
+        update_fields = self.update_fields(spec)
+        conflict = 'DO NOTHING'
+        if update and update_fields:
+            conflict = 'DO UPDATE SET ' + ', '.join(
+                f'{field} = EXCLUDED.{field}' for field in update_fields
+            )
+        partitions = (key_fields, *((field,) for field in other_fields))
+        ranks = ', '.join(
+            f'ROW_NUMBER() OVER (PARTITION BY {", ".join(fields)}) '
+            f'AS rank_{index}'
+            for index, fields in enumerate(partitions)
+        )
+        conditions = [
+            f'staged.rank_{index} = 1' for index in range(len(partitions))
+        ]
+        same_key = ' AND '.join(
+            f'existing.{field} = staged.{field}' for field in key_fields
+        )
+        conditions.extend(
+            f'NOT EXISTS (SELECT 1 FROM {table} existing '
+            f'WHERE existing.{field} = staged.{field} AND NOT ({same_key}))'
+            for field in other_fields
+        )
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        staging = f'{table}_staging'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DROP '
+                f'AS SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            cursor.execute(f'TRUNCATE {staging}')
+            cursor.cursor.copy_expert(
+                f'COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {columns} FROM ('
+                f'SELECT {columns}, {ranks} FROM {staging}'
+                f') staged WHERE {" AND ".join(conditions)} '
+                f'ON CONFLICT ({", ".join(key_fields)}) {conflict}'
+            )
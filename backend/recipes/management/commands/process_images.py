@@ -0,0 +1,103 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from recipes.constants import (IMAGE_ERROR_KEY, IMAGE_MAX_ATTEMPTS,
+                               IMAGE_WORKER_BATCH_SIZE, IMAGE_WORKER_INTERVAL)
+from recipes.images import build_variants, delete_variants, failure
+from recipes.models import Recipe
+
+
+def process(image_name):
+    try:
+        return build_variants(image_name), None
+    except Exception as error:
+        return None, f'{type(error).__name__}: {error}'
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные WebP и JPEG варианты изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать варианты для всех рецептов',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Работать постоянно, ожидая новые изображения',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMAGE_WORKER_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--interval', type=float, default=IMAGE_WORKER_INTERVAL
+        )
+
+    def handle(self, *args, **options):
+        # Неудачные попытки повторяются, пока их меньше
+        # IMAGE_MAX_ATTEMPTS: ошибка может быть временной.
+        pending = Recipe.objects.exclude(image='').filter(
+            Q(image_variants__isnull=True)
+            | Q(
+                image_variants__has_key=IMAGE_ERROR_KEY,
+                image_variants__attempts__lt=IMAGE_MAX_ATTEMPTS,
+            )
+        )
+        queryset = (
+            Recipe.objects.exclude(image='') if options['all'] else pending
+        )
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=options['workers'], initializer=django.setup
+        ) as pool:
+            last_id = 0
+            while True:
+                batch = list(
+                    queryset.filter(id__gt=last_id).order_by('id').values_list(
+                        'id', 'image', 'image_variants'
+                    )[:options['batch_size']]
+                )
+                if batch:
+                    last_id = batch[-1][0]
+                    self.process_batch(pool, batch)
+                    continue
+                if not options['loop']:
+                    break
+                queryset = pending
+                last_id = 0
+                time.sleep(options['interval'])
+
+    def process_batch(self, pool, batch):
+        """Сохраняет варианты, если изображение за это время не сменили.
+
+        Файлы, которые больше не нужны, удаляются: прежние варианты
+        после пересоздания и новые, если изображение уже другое.
+        """
+        results = pool.map(process, [image for _, image, _ in batch])
+        for (recipe_id, image, previous), (variants, error) in zip(
+            batch, results
+        ):
+            if error:
+                self.stderr.write(f'Рецепт {recipe_id} ({image}): {error}')
+                variants = failure(error, previous)
+            updated = Recipe.objects.filter(id=recipe_id, image=image).update(
+                image_variants=variants
+            )
+            if not updated:
+                delete_variants(variants)
+                continue
+            Recipe.objects.exclude(id=recipe_id).delete_unused_variants(
+                image, previous
+            )
+        self.stdout.write(f'Обработано изображений: {len(batch)}')
@@ -0,0 +1,78 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.constants import SHOPPING_LIST_REBUILD_BATCH_SIZE
+from recipes.models import ShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки покупок и сверяет их с корзинами'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить списки, ничего не изменяя',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=SHOPPING_LIST_REBUILD_BATCH_SIZE,
+            help='Пользователей в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = sorted(
+            set(ShoppingCart.objects.values_list('user_id', flat=True))
+            | set(ShoppingListItem.objects.values_list('user_id', flat=True))
+        )
+        fixed = 0
+        for start in range(0, len(user_ids), options['batch_size']):
+            batch = user_ids[start:start + options['batch_size']]
+            with transaction.atomic():
+                fixed += self.rebuild(batch, options['check'])
+        if options['check']:
+            if fixed:
+                raise CommandError(f'Расхождений: {fixed}')
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересчитаны, исправлено позиций: {fixed}'
+        ))
+
+    def rebuild(self, user_ids, check):
+        """Сверяет и исправляет списки пользователей user_ids.
+
+        Позиции блокируются до чтения корзин, поэтому изменение корзины,
+        закоммиченное между двумя чтениями, не исказит расхождение.
+        Блокируются только позиции этих пользователей.
+        """
+        stored = ShoppingListItem.objects.filter(user_id__in=user_ids)
+        if not check:
+            stored = stored.select_for_update()
+        stored = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in stored.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )
+        }
+        live = {
+            (row['user_id'], row['ingredient_id']): row['total_amount']
+            for row in ShoppingListItem.objects.live_totals().filter(
+                user_id__in=user_ids
+            )
+        }
+        drift = sorted(
+            key for key in live.keys() | stored.keys()
+            if live.get(key) != stored.get(key)
+        )
+        for user_id, ingredient_id in drift:
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'stored={stored.get((user_id, ingredient_id))} '
+                f'live={live.get((user_id, ingredient_id))}'
+            )
+        if not check:
+            ShoppingListItem.objects.apply_changes({
+                key: live.get(key, 0) - stored.get(key, 0) for key in drift
+            })
+        return len(drift)
@@ -0,0 +1,62 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def actual_count(related_model, related_field):
+    return Coalesce(
+        models.Subquery(
+            related_model.objects.filter(
+                **{related_field: models.OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                count=models.Count('pk')
+            ).values('count')
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = 'Сверяет и исправляет счётчики рецептов и пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить счётчики, ничего не изменяя',
+        )
+
+    def handle(self, *args, **options):
+        total_drift = 0
+        with transaction.atomic():
+            for model, field, related_model, related_field in COUNTERS:
+                drifted = model.objects.annotate(
+                    actual=actual_count(related_model, related_field)
+                ).exclude(**{field: models.F('actual')})
+                ids = list(drifted.values_list('pk', flat=True))
+                total_drift += len(ids)
+                self.stdout.write(
+                    f'{model.__name__}.{field}: расхождений {len(ids)}'
+                )
+                if ids and not options['check']:
+                    model.objects.filter(pk__in=ids).update(**{
+                        field: actual_count(related_model, related_field)
+                    })
+        if not total_drift:
+            self.stdout.write(self.style.SUCCESS('Счётчики в порядке'))
+        elif options['check']:
+            raise CommandError(f'Расхождений: {total_drift}')
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f'Исправлено счётчиков: {total_drift}')
+            )
@@ -0,0 +1,58 @@
+# Generated by Django 3.2 on 2026-10-17 23:25
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+FTS_TABLE = 'recipes_recipe_fts'
+FOLD = "replace(replace({}, 'ё', 'е'), 'Ё', 'Е')"
+
+POSTGRESQL_FORWARD = (
+    'CREATE INDEX recipes_recipe_search_vector_gin '
+    'ON recipes_recipe USING gin (search_vector)',
+    "UPDATE recipes_recipe SET search_vector = "
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(text, '')), 'B')",
+)
+POSTGRESQL_BACKWARD = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector_gin',
+)
+SQLITE_FORWARD = (
+    f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+    "name, text, tokenize = 'unicode61 remove_diacritics 2')",
+    f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+    f'SELECT id, {FOLD.format("name")}, {FOLD.format("text")} '
+    'FROM recipes_recipe',
+)
+SQLITE_BACKWARD = (
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+)
+
+
+def run_for_vendor(postgresql, sqlite):
+    def run(apps, schema_editor):
+        statements = {
+            'postgresql': postgresql,
+            'sqlite': sqlite,
+        }.get(schema_editor.connection.vendor, ())
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            run_for_vendor(POSTGRESQL_FORWARD, SQLITE_FORWARD),
+            run_for_vendor(POSTGRESQL_BACKWARD, SQLITE_BACKWARD),
+        ),
+    ]
@@ -1,13 +1,42 @@
+import re
+from itertools import islice
+
+from django.contrib.postgres.search import (SearchHeadline, SearchQuery,
+                                            SearchRank, SearchVector,
+                                            SearchVectorField)
 from django.core import validators
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Replace, RowNumber
 
-from users.models import User
+from users.models import Follow, User
 from .constants import (CHAR_FIELD_MAX_LENGTH,
                         RECIPE_TEXT_MAX_LENGTH,
+                        FEED_BACKFILL_SIZE, FEED_FANOUT_MAX_FOLLOWERS,
+                        FEED_INSERT_BATCH_SIZE, FEED_RETENTION,
                         HEX_COLOR_FIELD_MAX_LENGTH,
                         COOKING_TIME_MIN_VALUE,
                         INGREDIENT_AMOUNT_MIN_VALUE,
-                        DEFAULT_HEX_COLOR, HEX_COLOR_REGULAR_EXPRESSION)
+                        DEFAULT_HEX_COLOR, HEX_COLOR_REGULAR_EXPRESSION,
+                        SEARCH_CONFIG, SEARCH_FTS_TABLE,
+                        SEARCH_HIGHLIGHT_START, SEARCH_HIGHLIGHT_STOP,
+                        SIMILAR_INSERT_BATCH_SIZE)
+from .images import delete_variants
+
+
+def fold_search_text(value):
+    return value.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def fold_search_expression(field):
+    return Replace(
+        Replace(
+            field, models.Value('ё'), models.Value('е'),
+            output_field=models.TextField(),
+        ),
+        models.Value('Ё'), models.Value('Е'),
+        output_field=models.TextField(),
+    )
 
 
 class Tag(models.Model):
@@ -69,6 +98,143 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}.'
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredient_amount',
+                queryset=IngredientMeasure.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+    def limited_per_author(self, author_ids, limit=None):
+        if not author_ids:
+            return self.none()
+        queryset = self.filter(author_id__in=author_ids).order_by(
+            '-pub_date', '-id'
+        )
+        if limit is None:
+            return queryset
+        ranked = self.filter(author_id__in=author_ids).annotate(
+            row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=[models.F('author_id')],
+                order_by=[models.F('pub_date').desc(), models.F('id').desc()],
+            )
+        ).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.row_number <= %s',
+            (*params, limit)
+        ))
+
+    def search(self, value, highlight=False):
+        if connections[self.db].vendor == 'postgresql':
+            return self._search_postgresql(value, highlight)
+        return self._search_fts5(value, highlight)
+
+    def _search_postgresql(self, value, highlight):
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        queryset = self.filter(search_vector=query).annotate(
+            rank=SearchRank(models.F('search_vector'), query)
+        ).order_by('-rank', '-pub_date', '-id')
+        if highlight:
+            queryset = queryset.annotate(**{
+                f'{field}_highlight': SearchHeadline(
+                    field, query, config=SEARCH_CONFIG,
+                    start_sel=SEARCH_HIGHLIGHT_START,
+                    stop_sel=SEARCH_HIGHLIGHT_STOP,
+                )
+                for field in ('name', 'text')
+            })
+        return queryset
+
+    def _search_fts5(self, value, highlight):
+        terms = re.findall(r'\w+', fold_search_text(value))
+        if not terms:
+            return self.none()
+        query = ' '.join(f'"{term}"*' for term in terms)
+        match = f'FROM {SEARCH_FTS_TABLE} WHERE {SEARCH_FTS_TABLE} MATCH %s'
+        row = (
+            f'{match} AND {SEARCH_FTS_TABLE}.rowid = '
+            f'{self.model._meta.db_table}.id'
+        )
+        queryset = self.filter(
+            id__in=RawSQL(f'SELECT rowid {match}', (query,))
+        ).annotate(
+            rank=RawSQL(f'SELECT -bm25({SEARCH_FTS_TABLE}) {row}', (query,))
+        ).order_by('-rank', '-pub_date', '-id')
+        if highlight:
+            queryset = queryset.annotate(**{
+                f'{field}_highlight': RawSQL(
+                    f'SELECT highlight({SEARCH_FTS_TABLE}, {column}, %s, %s) '
+                    f'{row}',
+                    (SEARCH_HIGHLIGHT_START, SEARCH_HIGHLIGHT_STOP, query)
+                )
+                for column, field in enumerate(('name', 'text'))
+            })
+        return queryset
+
+    def update_search_index(self):
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            self.update(search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+            ))
+        elif connection.vendor == 'sqlite':
+            sql, params = self.order_by().values_list(
+                'id', fold_search_expression('name'),
+                fold_search_expression('text'),
+            ).query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT OR REPLACE INTO {SEARCH_FTS_TABLE} '
+                    f'(rowid, name, text) {sql}',
+                    params
+                )
+
+    def delete_unused_variants(self, image, variants):
+        """Удаляет файлы вариантов, если изображение больше ни у кого.
+
+        Сгенерированные рецепты делят одну картинку и её варианты.
+        """
+        if not self.filter(image=image).exists():
+            delete_variants(variants)
+
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                author_is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            author_is_subscribed=models.Exists(Follow.objects.filter(
+                user=user, author=models.OuterRef('author')
+            )),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User, on_delete=models.CASCADE,
@@ -103,6 +269,34 @@ class Recipe(models.Model):
         verbose_name='Изображение',
         upload_to='media/'
     )
+    search_vector = SearchVectorField(null=True, editable=False)
+    image_variants = models.JSONField(
+        verbose_name='Варианты изображения',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    fanned_out = models.BooleanField(
+        verbose_name='Разослан в ленты',
+        default=False,
+        editable=False,
+    )
+    similar_outdated = models.BooleanField(
+        verbose_name='Похожие рецепты устарели',
+        default=True,
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+        db_index=True,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время готовки',
         default=COOKING_TIME_MIN_VALUE,
@@ -110,6 +304,8 @@ class Recipe(models.Model):
             COOKING_TIME_MIN_VALUE, 'Минимум одна минута')],
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -117,10 +313,51 @@ class Recipe(models.Model):
                 name='unique_author_name'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date'
+            ),
+            models.Index(
+                fields=['id'],
+                condition=models.Q(fanned_out=False),
+                name='recipe_fan_out_pending'
+            ),
+            models.Index(
+                fields=['id'],
+                condition=models.Q(similar_outdated=True),
+                name='recipe_similar_outdated'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'name', 'text'} & set(update_fields):
+            self.update_search_index()
+
+    def update_search_index(self):
+        Recipe.objects.using(self._state.db).filter(
+            pk=self.pk
+        ).update_search_index()
+
+
+def delete_search_index(sender, instance, using, **kwargs):
+    """Убирает удалённый рецепт из FTS5.
+
+    В PostgreSQL вектор хранится в строке рецепта и удаляется с ней.
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_FTS_TABLE} WHERE rowid = %s',
+                (instance.pk,)
+            )
+
 
 class IngredientMeasure(models.Model):
     ingredient = models.ForeignKey(
@@ -207,3 +444,408 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.recipe} - {self.user}'
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+
+    def apply_changes(self, changes):
+        """Прибавляет к позициям списков изменения {(user, ingredient): delta}.
+
+        Недостающие позиции сначала вставляются с нулём: одновременная
+        вставка той же позиции другим запросом пропускается, а не
+        падает на уникальности. Затем позиции блокируются в порядке
+        (user, ingredient), чтобы встречные изменения не ждали друг
+        друга по кругу, меняются, а опустевшие удаляются. Если позицию
+        с положительной добавкой успели удалить между вставкой и
+        блокировкой, вставка повторяется.
+        """
+        pending = {
+            key: delta for key, delta in sorted(changes.items()) if delta
+        }
+        with transaction.atomic(using=self.db):
+            while pending:
+                pending = self._apply_locked(pending)
+
+    def _apply_locked(self, changes):
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    total_amount=0
+                )
+                for (user_id, ingredient_id), delta in changes.items()
+                if delta > 0
+            ),
+            ignore_conflicts=True,
+        )
+        items = {
+            (item.user_id, item.ingredient_id): item
+            for item in self.select_for_update().filter(
+                user_id__in={user_id for user_id, _ in changes},
+                ingredient_id__in={
+                    ingredient_id for _, ingredient_id in changes
+                },
+            ).order_by('user_id', 'ingredient_id')
+        }
+        to_update, to_delete, missing = [], [], {}
+        for key, delta in changes.items():
+            item = items.get(key)
+            if item is None:
+                if delta > 0:
+                    missing[key] = delta
+                continue
+            item.total_amount += delta
+            if item.total_amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.pk)
+        if to_update:
+            self.bulk_update(to_update, ['total_amount'])
+        if to_delete:
+            self.filter(pk__in=to_delete).delete()
+        return missing
+
+    def add_recipe(self, recipe_id, user_ids, sign=1):
+        amounts = IngredientMeasure.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+        self.apply_changes({
+            (user_id, ingredient_id): sign * amount
+            for ingredient_id, amount in amounts
+            for user_id in user_ids
+        })
+
+    def remove_recipe(self, recipe_id, user_ids):
+        self.add_recipe(recipe_id, user_ids, sign=-1)
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        deltas = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        user_ids = recipe.shopping_cart.values_list('user_id', flat=True)
+        self.apply_changes({
+            (user_id, ingredient_id): delta
+            for ingredient_id, delta in deltas.items()
+            for user_id in user_ids
+        })
+
+    def live_totals(self):
+        return IngredientMeasure.objects.filter(
+            recipe__shopping_cart__isnull=False
+        ).values(
+            'ingredient_id',
+            user_id=models.F('recipe__shopping_cart__user'),
+        ).annotate(
+            total_amount=models.Sum('amount')
+        ).order_by()
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингридиент'
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Общее количество'
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.total_amount}'
+
+
+def before_position(position, id_field):
+    if position is None:
+        return models.Q()
+    pub_date, pk = position
+    return models.Q(pub_date__lt=pub_date) | models.Q(
+        pub_date=pub_date, **{f'{id_field}__lt': pk}
+    )
+
+
+class FeedEntryQuerySet(models.QuerySet):
+
+    def add_recipes(self, user_ids, recipes):
+        entries = (
+            self.model(user_id=user_id, recipe_id=recipe_id, pub_date=pub_date)
+            for user_id in user_ids
+            for recipe_id, pub_date in recipes
+        )
+        while True:
+            batch = list(islice(entries, FEED_INSERT_BATCH_SIZE))
+            if not batch:
+                break
+            self.bulk_create(batch, ignore_conflicts=True)
+
+    @transaction.atomic
+    def fan_out(self, recipe):
+        """Рассылает рецепт подписчикам автора и отмечает его разосланным.
+
+        Рецепты авторов с числом подписчиков больше
+        FEED_FANOUT_MAX_FOLLOWERS не рассылаются: их подмешивает
+        timeline при чтении. Возвращает подписчиков, чьи ленты
+        выросли и нуждаются в trim.
+        """
+        follower_ids = []
+        if recipe.author.followers_count <= FEED_FANOUT_MAX_FOLLOWERS:
+            follower_ids = list(Follow.objects.filter(
+                author_id=recipe.author_id
+            ).values_list('user_id', flat=True))
+            self.add_recipes(follower_ids, [(recipe.id, recipe.pub_date)])
+        Recipe.objects.filter(id=recipe.id).update(fanned_out=True)
+        return follower_ids
+
+    def backfill(self, user_id, author):
+        if author.followers_count > FEED_FANOUT_MAX_FOLLOWERS:
+            return
+        recipes = Recipe.objects.filter(
+            author=author, fanned_out=True
+        ).order_by('-pub_date', '-id').values_list(
+            'id', 'pub_date'
+        )[:FEED_BACKFILL_SIZE]
+        self.add_recipes([user_id], recipes)
+        self.trim([user_id])
+
+    def remove_author(self, user_id, author):
+        self.filter(user_id=user_id, recipe__author=author).delete()
+
+    def trim(self, user_ids):
+        ranked = self.filter(user_id__in=user_ids).annotate(
+            row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=[models.F('user_id')],
+                order_by=[
+                    models.F('pub_date').desc(),
+                    models.F('recipe_id').desc(),
+                ],
+            )
+        ).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        self.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.row_number > %s',
+            (*params, FEED_RETENTION)
+        )).delete()
+
+    def fill(self, follows):
+        """Заполняет ленты по подпискам follows набором запросов.
+
+        Результат тот же, что после backfill при каждой подписке:
+        по FEED_BACKFILL_SIZE последних рецептов некрупного автора,
+        не больше FEED_RETENTION записей на ленту.
+        """
+        recipes_sql, recipes_params = Recipe.objects.filter(
+            fanned_out=True,
+            author__followers_count__lte=FEED_FANOUT_MAX_FOLLOWERS,
+        ).annotate(
+            row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=[models.F('author_id')],
+                order_by=[models.F('pub_date').desc(), models.F('id').desc()],
+            )
+        ).values(
+            'id', 'author_id', 'pub_date', 'row_number'
+        ).query.sql_with_params()
+        follows_sql, follows_params = follows.values(
+            'user_id', 'author_id'
+        ).query.sql_with_params()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.model._meta.db_table} '
+                '(user_id, recipe_id, pub_date) '
+                'SELECT ranked.user_id, ranked.id, ranked.pub_date FROM ('
+                'SELECT follows.user_id, recipes.id, recipes.pub_date, '
+                'ROW_NUMBER() OVER (PARTITION BY follows.user_id '
+                'ORDER BY recipes.pub_date DESC, recipes.id DESC) '
+                'AS row_number '
+                f'FROM ({follows_sql}) follows '
+                f'JOIN ({recipes_sql}) recipes '
+                'ON recipes.author_id = follows.author_id '
+                'WHERE recipes.row_number <= %s'
+                ') ranked WHERE ranked.row_number <= %s '
+                'ON CONFLICT DO NOTHING',
+                (
+                    *follows_params, *recipes_params,
+                    FEED_BACKFILL_SIZE, FEED_RETENTION,
+                )
+            )
+
+    def timeline(self, user, position=None, limit=None):
+        """Идентификаторы рецептов ленты, новые первыми.
+
+        Разосланные записи читаются одним диапазоном по индексу
+        (user, -pub_date, -recipe), а рецепты крупных авторов
+        добираются тем же диапазоном по (author, -pub_date, -id)
+        и сливаются с ними.
+        """
+        entries = self.filter(
+            before_position(position, 'recipe_id'), user=user
+        ).order_by('-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id'
+        )[:limit]
+        merged = Recipe.objects.filter(
+            before_position(position, 'id'),
+            author__in=Follow.objects.filter(
+                user=user,
+                author__followers_count__gt=FEED_FANOUT_MAX_FOLLOWERS,
+            ).values('author_id'),
+        ).order_by('-pub_date', '-id').values_list('pub_date', 'id')[:limit]
+        rows = sorted(set(entries) | set(merged), reverse=True)
+        return [recipe_id for _, recipe_id in rows[:limit]]
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_entry_timeline'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class SimilarRecipeQuerySet(models.QuerySet):
+
+    def add(self, rows):
+        entries = (
+            self.model(recipe_id=recipe_id, similar_id=similar_id, score=score)
+            for recipe_id, similar_id, score in rows
+        )
+        while True:
+            batch = list(islice(entries, SIMILAR_INSERT_BATCH_SIZE))
+            if not batch:
+                break
+            self.bulk_create(batch, ignore_conflicts=True)
+
+    @transaction.atomic
+    def replace(self, neighbours):
+        """Заменяет списки похожих для рецептов из neighbours.
+
+        neighbours — словарь {recipe_id: [(similar_id, score), ...]}.
+        """
+        self.filter(recipe_id__in=list(neighbours)).delete()
+        self.add(
+            (recipe_id, similar_id, score)
+            for recipe_id, rows in neighbours.items()
+            for similar_id, score in rows
+        )
+
+    @transaction.atomic
+    def link_back(self, changed_ids, rows, top):
+        """Обновляет чужие списки после изменения рецептов changed_ids.
+
+        Прежние ссылки на изменённые рецепты удаляются, новые
+        добавляются, после чего каждый затронутый список снова
+        обрезается до top лучших.
+        """
+        if changed_ids:
+            self.filter(similar_id__in=changed_ids).exclude(
+                recipe_id__in=changed_ids
+            ).delete()
+        rows = list(rows)
+        self.add(rows)
+        self.trim({recipe_id for recipe_id, _, _ in rows}, top)
+
+    def trim(self, recipe_ids, top):
+        if not recipe_ids:
+            return
+        ranked = self.filter(recipe_id__in=recipe_ids).annotate(
+            row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=[models.F('recipe_id')],
+                order_by=[models.F('score').desc(), models.F('id').asc()],
+            )
+        ).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        self.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.row_number > %s',
+            (*params, top)
+        )).delete()
+
+
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField('Сходство')
+
+    objects = SimilarRecipeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=['recipe', '-score'],
+                name='similar_recipe_lookup'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} - {self.similar}'
@@ -0,0 +1,99 @@
+import numpy as np
+from scipy import sparse
+
+from .constants import (SIMILAR_COMMON_INGREDIENT_MIN_RECIPES,
+                        SIMILAR_MAX_INGREDIENT_SHARE, SIMILAR_TAG_WEIGHT)
+
+matrices = {}
+
+
+def common_limit(recipes_count):
+    """Во скольких рецептах признак ещё не считается общим."""
+    return max(
+        SIMILAR_MAX_INGREDIENT_SHARE * recipes_count,
+        SIMILAR_COMMON_INGREDIENT_MIN_RECIPES,
+    )
+
+
+def build_matrix(recipe_ids, pairs, drop_common=False, excluded=None):
+    """Бинарная матрица рецепт × признак с нормированными строками.
+
+    pairs — пары (recipe_id, feature_id). Общие признаки, которые
+    встречаются чаще common_limit (соль, вода), отбрасываются: они
+    ничего не говорят о сходстве, но делают произведение плотным.
+    При drop_common они считаются по самим pairs, а если в pairs
+    только часть рецептов, их заранее передают в excluded.
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    if excluded is not None:
+        pairs = pairs[~np.isin(pairs[:, 1], list(excluded))]
+    rows = np.searchsorted(recipe_ids, pairs[:, 0])
+    known = (rows < len(recipe_ids)) & (
+        recipe_ids[np.minimum(rows, len(recipe_ids) - 1)] == pairs[:, 0]
+    )
+    rows, columns = rows[known], pairs[known, 1]
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, columns)),
+        shape=(len(recipe_ids), columns.max() + 1 if len(columns) else 1),
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    if drop_common and len(recipe_ids):
+        counts = np.asarray(matrix.sum(axis=0)).ravel()
+        limit = common_limit(len(recipe_ids))
+        matrix = matrix @ sparse.diags((counts <= limit).astype(float))
+        matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def build_matrices(recipe_ids, ingredient_pairs, tag_pairs,
+                   common_ingredients=None):
+    return (
+        build_matrix(
+            recipe_ids, ingredient_pairs,
+            drop_common=common_ingredients is None,
+            excluded=common_ingredients,
+        ).tocsr(),
+        build_matrix(recipe_ids, tag_pairs).tocsr(),
+    )
+
+
+def set_matrices(ingredients, tags):
+    matrices['ingredients'] = ingredients
+    matrices['tags'] = tags
+    matrices['ingredients_t'] = ingredients.T.tocsr()
+    matrices['tags_t'] = tags.T.tocsr()
+
+
+def scores(rows):
+    """Сходство рецептов rows со всеми рецептами.
+
+    Косинус по ингредиентам, усиленный косинусом по тегам: рецепты
+    без общих ингредиентов остаются несхожими при любых тегах.
+    """
+    ingredients = matrices['ingredients'][rows] @ matrices['ingredients_t']
+    tags = matrices['tags'][rows] @ matrices['tags_t']
+    return (
+        ingredients + ingredients.multiply(tags) * SIMILAR_TAG_WEIGHT
+    ).tocsr()
+
+
+def top_neighbours(rows, top):
+    result = []
+    chunk = scores(rows)
+    for offset, row in enumerate(rows):
+        begin, end = chunk.indptr[offset], chunk.indptr[offset + 1]
+        columns = chunk.indices[begin:end]
+        values = chunk.data[begin:end]
+        keep = columns != row
+        columns, values = columns[keep], values[keep]
+        if len(values) > top:
+            best = np.argpartition(-values, top)[:top]
+            columns, values = columns[best], values[best]
+        order = np.argsort(-values, kind='stable')
+        result.append(
+            (int(row), columns[order].tolist(), values[order].tolist())
+        )
+    return result
@@ -0,0 +1,352 @@
+import json
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import models
+from django.test import TestCase, override_settings
+
+from PIL import Image
+
+from recipes import similarity
+from recipes.constants import IMAGE_ERROR_KEY, IMAGE_MAX_ATTEMPTS
+from recipes.images import variant_files, variant_urls
+from recipes.management.commands.generate_fake_data import draw_pairs
+from recipes.models import (Favorite, Ingredient, IngredientMeasure, Recipe,
+                            ShoppingCart, ShoppingListItem, SimilarRecipe,
+                            Tag)
+from users.models import Follow, User
+
+COMMAND = 'recipes.management.commands.build_similar_recipes'
+
+
+class BuildSimilarRecipesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тест',
+        )
+        cls.recipes = []
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                author=author, name=f'рецепт {i}', text='описание',
+                cooking_time=10, image='recipes/test.png',
+            )
+            recipe.tags.add(Tag.objects.create(
+                name=f'тег {i}', slug=f'tag-{i}', color=f'#00000{i}'
+            ))
+            IngredientMeasure.objects.create(
+                recipe=recipe, amount=1,
+                ingredient=Ingredient.objects.create(
+                    name=f'ингредиент {i}', measurement_unit='г'
+                ),
+            )
+            cls.recipes.append(recipe)
+
+    def build(self, **options):
+        call_command(
+            'build_similar_recipes', workers=1, stdout=StringIO(), **options
+        )
+
+    def test_recipe_without_neighbours(self):
+        Recipe.objects.update(similar_outdated=False)
+        Recipe.objects.filter(id=self.recipes[0].id).update(
+            similar_outdated=True
+        )
+        self.build()
+        self.assertFalse(
+            Recipe.objects.filter(similar_outdated=True).exists()
+        )
+        self.assertFalse(SimilarRecipe.objects.exists())
+
+    def test_recipes_with_common_ingredient(self):
+        IngredientMeasure.objects.create(
+            recipe=self.recipes[1], amount=1,
+            ingredient=self.recipes[2].ingredients.get(),
+        )
+        Recipe.objects.update(similar_outdated=True)
+        self.build()
+        self.assertEqual(
+            set(SimilarRecipe.objects.values_list('recipe', 'similar')),
+            {
+                (self.recipes[1].id, self.recipes[2].id),
+                (self.recipes[2].id, self.recipes[1].id),
+            },
+        )
+
+    def test_incremental_build_reads_only_related_recipes(self):
+        IngredientMeasure.objects.create(
+            recipe=self.recipes[1], amount=1,
+            ingredient=self.recipes[2].ingredients.get(),
+        )
+        Recipe.objects.update(similar_outdated=True)
+        self.build()
+        Recipe.objects.filter(id=self.recipes[2].id).update(
+            similar_outdated=True
+        )
+        with mock.patch(
+            f'{COMMAND}.build_matrices', wraps=similarity.build_matrices
+        ) as build_matrices:
+            self.build()
+        recipe_ids = build_matrices.call_args.args[0]
+        self.assertEqual(
+            recipe_ids.tolist(), [self.recipes[1].id, self.recipes[2].id]
+        )
+        self.assertEqual(
+            set(SimilarRecipe.objects.values_list('recipe', 'similar')),
+            {
+                (self.recipes[1].id, self.recipes[2].id),
+                (self.recipes[2].id, self.recipes[1].id),
+            },
+        )
+
+    def test_edit_during_build_keeps_flag(self):
+        recipe = self.recipes[0]
+
+        def edit_during_build(*args):
+            Recipe.objects.filter(id=recipe.id).update(
+                similar_outdated=True
+            )
+            return similarity.build_matrices(*args)
+
+        Recipe.objects.update(similar_outdated=True)
+        with mock.patch(
+            f'{COMMAND}.build_matrices', side_effect=edit_during_build
+        ):
+            self.build()
+        self.assertEqual(
+            list(Recipe.objects.filter(
+                similar_outdated=True
+            ).values_list('id', flat=True)),
+            [recipe.id],
+        )
+
+    def test_failed_build_restores_flags(self):
+        Recipe.objects.update(similar_outdated=True)
+        with mock.patch(
+            f'{COMMAND}.build_matrices', side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            self.build()
+        self.assertEqual(
+            Recipe.objects.filter(similar_outdated=True).count(), 3
+        )
+
+    def test_empty_links(self):
+        SimilarRecipe.objects.link_back([], [], top=5)
+        SimilarRecipe.objects.trim(set(), top=5)
+
+
+class LoadDataTests(TestCase):
+    """Повторная загрузка не дублирует записи и не падает."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write(self, name, content):
+        path = self.directory / name
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def load(self, model, path, *args):
+        call_command(
+            'load_data', model, *args, path=path, batch_size=2,
+            stdout=StringIO(),
+        )
+
+    def tags(self):
+        return set(Tag.objects.values_list('slug', 'name', 'color'))
+
+    def test_reload_ingredients(self):
+        path = self.write(
+            'ingredients.csv',
+            'name,measurement_unit\nсоль,г\nсахар,г\nсоль,г\nмука,кг\n'
+        )
+        for _ in range(2):
+            self.load('ingredients', path)
+            self.assertEqual(
+                set(Ingredient.objects.values_list(
+                    'name', 'measurement_unit'
+                )),
+                {('соль', 'г'), ('сахар', 'г'), ('мука', 'кг')},
+            )
+
+    def test_json_input(self):
+        path = self.write('ingredients.json', json.dumps([
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'fields': {'name': 'перец', 'measurement_unit': 'г'}},
+        ]))
+        self.load('ingredients', path)
+        self.load('ingredients', path)
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_tags_skip_or_update_existing(self):
+        self.load('tags', self.write(
+            'tags.csv', '1,Завтрак,#66ffff,breakfast\n2,Обед,#ff6666,lunch\n'
+        ))
+        changed = self.write(
+            'changed.csv',
+            '1,Утро,#000001,breakfast\n'
+            '3,Полдник,#000003,snack\n'
+            '4,Обед,#000004,brunch\n'
+        )
+        self.load('tags', changed)
+        self.assertEqual(self.tags(), {
+            ('breakfast', 'Завтрак', '#66ffff'),
+            ('lunch', 'Обед', '#ff6666'),
+            ('snack', 'Полдник', '#000003'),
+        })
+        self.load('tags', changed, '--update')
+        self.load('tags', changed, '--update')
+        self.assertEqual(self.tags(), {
+            ('breakfast', 'Утро', '#000001'),
+            ('lunch', 'Обед', '#ff6666'),
+            ('snack', 'Полдник', '#000003'),
+        })
+
+
+class GenerateFakeDataTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def generate(self, **options):
+        call_command(
+            'generate_fake_data', users=20, recipes=50, images=1,
+            batch_size=7, stdout=StringIO(), **options
+        )
+
+    def test_draw_pairs_without_repeats(self):
+        counts = np.array([3, 0, 5, 2])
+        rows, children = draw_pairs(
+            counts, lambda count: np.arange(count) % 4
+        )
+        pairs = list(zip(rows.tolist(), children.tolist()))
+        self.assertEqual(len(pairs), len(set(pairs)))
+        self.assertTrue(
+            (np.bincount(rows, minlength=len(counts)) <= counts).all()
+        )
+
+    def test_generated_data_is_consistent(self):
+        for seed in (0, 1):
+            self.generate(seed=seed)
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(Recipe.objects.count(), 100)
+        self.assertFalse(Follow.objects.filter(
+            user=models.F('author')
+        ).exists())
+        for model in (Favorite, ShoppingCart, Follow):
+            self.assertTrue(model.objects.exists())
+        self.assertTrue(all(
+            IngredientMeasure.objects.filter(recipe=recipe).exists()
+            for recipe in Recipe.objects.all()
+        ))
+        call_command('reconcile_counters', check=True, stdout=StringIO())
+        self.assertEqual(
+            set(ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )),
+            set(ShoppingListItem.objects.live_totals().values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )),
+        )
+        recipe = Recipe.objects.last()
+        self.assertIn(
+            recipe, Recipe.objects.search(recipe.name.split()[0])
+        )
+
+
+class ProcessImagesTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тест',
+        )
+
+    def recipe(self, content):
+        return Recipe.objects.create(
+            author=self.author, name='рецепт', text='описание',
+            cooking_time=10,
+            image=default_storage.save('recipes/test.png', content),
+        )
+
+    def png(self):
+        buffer = BytesIO()
+        Image.new('RGB', (32, 16), (200, 100, 50)).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue())
+
+    def process(self, *args):
+        call_command(
+            'process_images', *args, workers=1, stdout=StringIO(),
+            stderr=StringIO(),
+        )
+
+    def test_failure_is_retried_until_limit(self):
+        recipe = self.recipe(ContentFile(b'not an image'))
+        for attempts in range(1, IMAGE_MAX_ATTEMPTS + 2):
+            self.process()
+            recipe.refresh_from_db()
+            self.assertIn(IMAGE_ERROR_KEY, recipe.image_variants)
+            self.assertEqual(
+                recipe.image_variants['attempts'],
+                min(attempts, IMAGE_MAX_ATTEMPTS),
+            )
+        self.assertEqual(variant_urls(recipe.image_variants), {})
+        default_storage.delete(recipe.image.name)
+        default_storage.save(recipe.image.name, self.png())
+        self.process('--all')
+        recipe.refresh_from_db()
+        self.assertNotIn(IMAGE_ERROR_KEY, recipe.image_variants)
+
+    def test_reprocessing_deletes_previous_files(self):
+        recipe = self.recipe(self.png())
+        self.process()
+        recipe.refresh_from_db()
+        previous = variant_files(recipe.image_variants)
+        self.assertTrue(all(map(default_storage.exists, previous)))
+        self.process('--all')
+        recipe.refresh_from_db()
+        current = variant_files(recipe.image_variants)
+        self.assertFalse(set(previous) & set(current))
+        self.assertFalse(any(map(default_storage.exists, previous)))
+        self.assertTrue(all(map(default_storage.exists, current)))
+
+    def test_shared_variants_are_kept(self):
+        recipe = self.recipe(self.png())
+        self.process()
+        recipe.refresh_from_db()
+        Recipe.objects.create(
+            author=self.author, name='копия', text='описание',
+            cooking_time=10, image=recipe.image.name,
+            image_variants=recipe.image_variants,
+        )
+        Recipe.objects.exclude(id=recipe.id).delete_unused_variants(
+            recipe.image.name, recipe.image_variants
+        )
+        self.assertTrue(all(map(
+            default_storage.exists, variant_files(recipe.image_variants)
+        )))
+        Recipe.objects.exclude(image=recipe.image.name).delete_unused_variants(
+            recipe.image.name, recipe.image_variants
+        )
+        self.assertFalse(any(map(
+            default_storage.exists, variant_files(recipe.image_variants)
+        )))
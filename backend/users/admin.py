@@ -1,9 +1,16 @@
 from django.contrib import admin
 
+from foodgram.paginators import EstimatedCountPaginator
 from users.models import Follow, User
 
 
-admin.site.register(Follow)
+@admin.register(Follow)
+class FollowAdmin(admin.ModelAdmin):
+    list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    raw_id_fields = ('user', 'author')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(User)
@@ -14,5 +21,9 @@ class UserAdmin(admin.ModelAdmin):
         'first_name',
         'last_name',
         'is_superuser',
+        'recipes_count',
+        'followers_count',
     )
     search_fields = ('email', 'username')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
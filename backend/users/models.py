@@ -15,6 +15,12 @@ class User(AbstractUser):
     )
     first_name = models.CharField(max_length=CHAR_FIELD_MAX_LENGTH)
     last_name = models.CharField(max_length=CHAR_FIELD_MAX_LENGTH)
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']